@@ -0,0 +1,87 @@
+"""
+Import time of the hanga modules.
+
+Each module is imported in a fresh interpreter with `-X importtime`
+(Python 3.7+), and its cumulative import time is compared to its budget.
+The modules only needed by some commands (requests, buildozer...) must not be
+imported by the client module itself.
+
+Usage::
+
+    python bench/importtime.py [--runs N] [--scale X]
+
+Exits with 1 if a budget is exceeded: `--scale` multiplies the budgets, for
+slow machines.
+"""
+
+from __future__ import print_function
+import argparse
+import subprocess
+import sys
+from os.path import abspath, dirname
+
+ROOT = dirname(dirname(abspath(__file__)))
+
+# module: (budget in ms, modules it must not import)
+BUDGETS = {
+    "hanga": (5, ("hanga.api", "requests")),
+    "hanga.scripts.client": (15, (
+        "hanga.api", "requests", "buildozer", "progressbar")),
+    "hanga.api": (80, ("buildozer", "progressbar")),
+}
+
+
+def import_time(module):
+    """Return the cumulative import time of the module in ms, and the names
+    of all the modules imported with it.
+    """
+    output = subprocess.check_output(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        stderr=subprocess.STDOUT, cwd=ROOT).decode("utf-8")
+    cumulative = None
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        name = fields[2].strip()
+        if not fields[1].strip().isdigit():
+            continue
+        modules.append(name)
+        if name == module:
+            cumulative = int(fields[1]) / 1000.
+    return cumulative, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5,
+                        help="number of imports per module, the best one "
+                        "is kept")
+    parser.add_argument("--scale", type=float, default=1.,
+                        help="multiply the budgets")
+    args = parser.parse_args()
+
+    if sys.version_info < (3, 7):
+        parser.error("-X importtime requires Python 3.7")
+
+    failed = False
+    for module, (budget, forbidden) in sorted(BUDGETS.items()):
+        budget *= args.scale
+        timings = []
+        for _ in range(args.runs):
+            cumulative, modules = import_time(module)
+            timings.append(cumulative)
+        best = min(timings)
+        unexpected = [name for name in forbidden if name in modules]
+        ok = best <= budget and not unexpected
+        failed = failed or not ok
+        print("{:<24} {:>7.1f} ms (budget {:.0f} ms) {}".format(
+            module, best, budget, "ok" if ok else "FAILED"))
+        for name in unexpected:
+            print("    imports {}".format(name))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Benchmarks of the Hanga client.
+
+The packing, upload, status polling (or streaming) and download are
+measured against a local stand-in server (:mod:`hanga.fakeserver`, run in
+its own process), for several application sizes::
+
+    python bench/suite.py --sizes 1,10,100 --output results.json
+    python bench/suite.py --compare results.json
+
+The stand-in can simulate a remote service with `--latency` and
+`--bandwidth`. Each benchmark is run `--runs` times and the best time is
+kept. With `--compare`, the results are compared to a previous run, and the
+script exits with 1 if a benchmark is slower by more than `--tolerance`.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from os import devnull, makedirs, urandom
+from os.path import abspath, dirname, exists, join
+from random import Random
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from hanga.api import HangaAPI  # noqa
+from hanga.pack import iter_pack, pack  # noqa
+
+KEY = "0" * 32
+MB = 1024 * 1024
+FILE_SIZE = 256 * 1024
+# slowdowns under this duration are measurement noise, in seconds
+MIN_DELTA = 0.01
+
+
+class StandIn(object):
+    """Run the stand-in server in a subprocess, so it doesn't compete with
+    the client for the GIL.
+    """
+
+    def __init__(self, **options):
+        super(StandIn, self).__init__()
+        command = [sys.executable, "-u", "-m", "hanga.fakeserver",
+                   "--port", "0", "--key", KEY]
+        for key, value in options.items():
+            command += ["--" + key.replace("_", "-"), str(value)]
+        self._log = open(devnull, "w")
+        self.process = subprocess.Popen(
+            command, cwd=ROOT, stdout=subprocess.PIPE, stderr=self._log)
+        line = self.process.stdout.readline().decode("utf-8")
+        self.url = line.split()[-1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.process.terminate()
+        self.process.wait()
+        self.process.stdout.close()
+        self._log.close()
+
+
+def make_app(directory, size, seed=0):
+    """Create an application of about `size` bytes: a third of text files,
+    the rest incompressible assets.
+
+    :return: the members to pack, as expected by :func:`hanga.pack.pack`.
+    """
+    rand = Random(seed)
+    words = ["".join(rand.choice("abcdefghijklmnopqrstuvwxyz")
+                     for _ in range(rand.randint(2, 10)))
+             for _ in range(500)]
+    text = " ".join(rand.choice(words) for _ in range(MB // 5)).encode(
+        "ascii")
+    members = []
+    index = 0
+    total = 0
+    while total < size:
+        length = min(FILE_SIZE, size - total)
+        if index % 3 == 0:
+            name = "app/src/module{}.py".format(index)
+            offset = rand.randint(0, len(text) - length)
+            content = text[offset:offset + length]
+        else:
+            name = "app/data/asset{}.png".format(index)
+            content = urandom(length)
+        filename = join(directory, *name.split("/"))
+        if not exists(dirname(filename)):
+            makedirs(dirname(filename))
+        with open(filename, "wb") as fd:
+            fd.write(content)
+        members.append((filename, name))
+        total += length
+        index += 1
+    return members
+
+
+def best_of(runs, func):
+    """Run func and return the best duration, with the result of the last
+    run.
+    """
+    durations = []
+    result = None
+    for _ in range(runs):
+        started = time.time()
+        result = func()
+        durations.append(time.time() - started)
+    return min(durations), result
+
+
+def bench_size(size, args, workdir):
+    """Benchmarks of the packing and the transfers of an application of
+    `size` bytes.
+    """
+    results = {}
+    label = "{}MB".format(size // MB)
+    app_dir = join(workdir, label)
+    members = make_app(app_dir, size)
+    zip_fn = join(workdir, label + ".zip")
+
+    def record(name, seconds, nbytes):
+        results["{}/{}".format(name, label)] = {
+            "seconds": round(seconds, 4),
+            "mb_per_s": round(nbytes / MB / seconds, 2) if seconds else None}
+        print("{:<28} {:>8.3f}s {:>9.1f} MB/s".format(
+            "{}/{}".format(name, label), seconds,
+            nbytes / MB / seconds if seconds else 0))
+
+    def do_pack():
+        with open(zip_fn, "wb") as fd:
+            pack(members, fd)
+    seconds, _ = best_of(args.runs, do_pack)
+    record("pack", seconds, size)
+
+    with StandIn(build_time=0, artifact_size=size, latency=args.latency,
+                 bandwidth=args.bandwidth) as server:
+        with HangaAPI(key=KEY, url=server.url) as api:
+            seconds, result = best_of(
+                args.runs, lambda: api.submit(["android"], zip_fn))
+            record("upload", seconds, size)
+            uuid = result["uuid"]
+
+            seconds, _ = best_of(args.runs, lambda: api.submit_chunked(
+                ["android"], zip_fn, workers=args.workers))
+            record("upload-parts", seconds, size)
+
+            seconds, _ = best_of(args.runs, lambda: api.submit_stream(
+                ["android"], iter_pack(members)))
+            record("upload-stream", seconds, size)
+
+            dl_dir = join(workdir, "dl")
+            if not exists(dl_dir):
+                makedirs(dl_dir)
+            seconds, _ = best_of(args.runs, lambda: api.download(
+                uuid, dl_dir, workers=1))
+            record("download", seconds, size)
+
+            seconds, _ = best_of(args.runs, lambda: api.download(
+                uuid, dl_dir, workers=args.workers))
+            record("download-parts", seconds, size)
+    return results
+
+
+def bench_polling(args, workdir):
+    """Time to notice the end of a build, and number of status requests,
+    with polling, long-polling and the status stream.
+    """
+    results = {}
+    build_time = args.build_time
+    zip_fn = join(workdir, "empty.zip")
+    with open(zip_fn, "wb") as fd:
+        pack([], fd)
+    with StandIn(build_time=build_time, artifact_size=1024,
+                 latency=args.latency) as server:
+        with HangaAPI(key=KEY, url=server.url) as api:
+            counter = {"requests": 0}
+            build_request = api._build_request
+
+            def counted(*largs, **kwargs):
+                counter["requests"] += 1
+                return build_request(*largs, **kwargs)
+            api._build_request = counted
+
+            for name, wait, stream in (("poll", None, False),
+                                       ("poll-long", 30, False),
+                                       ("poll-stream", None, True)):
+                uuid = api.submit(["android"], zip_fn)["uuid"]
+                started = time.time()
+                counter["requests"] = 0
+                for infos in api.iter_status(uuid, wait=wait, stream=stream):
+                    pass
+                lag = time.time() - started - build_time
+                results[name] = {
+                    "seconds": round(lag, 4),
+                    "requests": counter["requests"]}
+                print("{:<28} {:>8.3f}s {:>5} requests".format(
+                    name, lag, counter["requests"]))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the difference with the baseline, and return the names of the
+    benchmarks slower than it.
+    """
+    regressions = []
+    print("")
+    print("{:<28} {:>9} {:>9} {:>8}".format(
+        "Benchmark", "Baseline", "Now", "Change"))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old = baseline[name]["seconds"]
+        new = results[name]["seconds"]
+        change = (new - old) / old if old else 0.
+        flag = ""
+        if change > tolerance and new - old > MIN_DELTA:
+            flag = " SLOWER"
+            regressions.append(name)
+        print("{:<28} {:>8.3f}s {:>8.3f}s {:>+7.0%}{}".format(
+            name, old, new, change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="1,10,100",
+                        help="Application sizes in MB, comma separated")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Parallel parts for the transfers")
+    parser.add_argument("--latency", type=float, default=0.,
+                        help="Latency of the stand-in, in seconds")
+    parser.add_argument("--bandwidth", type=int, default=0,
+                        help="Bandwidth of the stand-in, per connection, in "
+                        "bytes per second")
+    parser.add_argument("--build-time", type=float, default=3.,
+                        help="Duration of the build for the polling")
+    parser.add_argument("--output", help="Save the results in this file")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="Compare with the results saved in this file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Slowdown tolerated by --compare")
+    args = parser.parse_args()
+
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="hanga-bench-")
+    try:
+        for size in args.sizes.split(","):
+            results.update(bench_size(int(size) * MB, args, workdir))
+        results.update(bench_polling(args, workdir))
+    finally:
+        shutil.rmtree(workdir)
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump({
+                "meta": {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "options": vars(args)},
+                "results": results}, fd, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as fd:
+            baseline = json.load(fd)["results"]
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
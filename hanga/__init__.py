@@ -8,5 +8,15 @@ Library for managing request on https://hanga.io/
 __version__ = "0.8.0-dev"
 __all__ = ["HangaAPI", "HangaException"]
 
+import sys
 
-from hanga.api import HangaAPI, HangaException
+if sys.version_info >= (3, 7):
+    # import the api (and requests) only when used, to start quickly
+    def __getattr__(name):
+        if name in __all__:
+            from hanga import api
+            return getattr(api, name)
+        raise AttributeError(
+            "module 'hanga' has no attribute '{}'".format(name))
+else:
+    from hanga.api import HangaAPI, HangaException
@@ -0,0 +1,104 @@
+"""
+Client of the Hanga agent.
+
+The agent (`hanga agent`, see :mod:`hanga.scripts.agent`) is a daemon
+keeping the connections to Hanga and the caches warm, and running the builds
+from a queue. The commands talk to it through a Unix socket: one JSON
+request per connection, answered by lines of JSON::
+
+    {"command": "submit", "spec": "/app/buildozer.spec", "wait": true}
+
+Every answer has a `result`, "ok" or "error" (with `details`). The messages
+sent while waiting for a build have an `event` instead.
+"""
+
+import socket
+from hanga import appdirs
+from hanga.api import HangaException
+from json import dumps, loads
+from os.path import join
+
+
+def agent_socket_fn():
+    """Return the default filename of the socket of the agent.
+    """
+    return join(appdirs.user_cache_dir('Hanga', 'Melting Rocks'),
+                "agent.sock")
+
+
+class AgentClient(object):
+    """Send requests to the agent listening on `socket_fn`. It has the same
+    :meth:`status_many` and :meth:`download` as :class:`hanga.HangaAPI`, made
+    with the connections of the agent.
+
+    :raise HangaException: if the agent is not running, or the request
+                           failed.
+    """
+
+    def __init__(self, socket_fn=None, timeout=None):
+        super(AgentClient, self).__init__()
+        self.socket_fn = socket_fn or agent_socket_fn()
+        self.timeout = timeout
+
+    def request(self, command, **params):
+        """Send a request, and iterate over the answers.
+        """
+        params["command"] = command
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            try:
+                sock.connect(self.socket_fn)
+            except socket.error as e:
+                raise HangaException(
+                    "The agent is not running ({})".format(e))
+            sock.sendall(dumps(params).encode("utf-8") + b"\n")
+            reader = sock.makefile("rb")
+            try:
+                for line in reader:
+                    yield loads(line.decode("utf-8"))
+            finally:
+                reader.close()
+        finally:
+            sock.close()
+
+    def call(self, command, **params):
+        """Send a request with a single answer, and return it.
+        """
+        for answer in self.request(command, **params):
+            if answer.get("result") != "ok":
+                raise HangaException(answer.get("details", "Agent error"))
+            return answer
+        raise HangaException("No answer from the agent")
+
+    def ping(self):
+        """Return the version and the pid of the agent.
+        """
+        return self.call("ping")
+
+    def submit(self, spec_fn, args, wait=True, arguments=None):
+        """Queue the build of the buildozer.spec `spec_fn`, and iterate over
+        the answers: the build queued, its events if `wait` is set, then its
+        summary.
+
+        `arguments` are the options of the command line applied to this
+        build (like "--workers" or "--reproducible").
+        """
+        return self.request("submit", spec=spec_fn, args=args, wait=wait,
+                            arguments=arguments or {})
+
+    def builds(self):
+        """Return the summaries of the builds of the agent.
+        """
+        return self.call("builds")["builds"]
+
+    def status_many(self, uuids):
+        return self.call("status", uuids=list(uuids))["statuses"]
+
+    def download(self, uuid, dest_dir, callback=None):
+        return self.call("download", uuid=uuid, dest_dir=dest_dir)["filename"]
+
+    def shutdown(self):
+        """Stop the agent, once the builds in progress are finished.
+        """
+        return self.call("shutdown")
@@ -0,0 +1,230 @@
+"""
+Asyncio client for Hanga
+========================
+
+Same API as :class:`hanga.HangaAPI`, with coroutines, so one event loop can
+drive many builds at the same time::
+
+    async with AsyncHangaAPI() as api:
+        result = await api.submit(["android"], "app.zip")
+        infos = await api.wait_for_build(result["uuid"])
+        if infos["job_status"] == "done":
+            await api.download(result["uuid"], "bin")
+
+Requires aiohttp 3.3 or later (`pip install hanga[async]`) and Python 3.6.
+"""
+
+import asyncio
+import aiohttp
+from hanga.api import BaseHangaAPI, HangaException, STATUS_WAIT
+from hanga.poll import StatusPoller, status_changed
+from json import dumps
+from os import replace as rename, stat
+from os.path import join
+from time import time
+
+BLOCKSIZE = 64 * 1024
+
+
+class AsyncHangaAPI(BaseHangaAPI):
+    """Asyncio API to communicate with Hanga.
+
+    The requests share one pooled session, opened on the first request:
+    `limit` is the total number of connections, `limit_per_host` the number
+    per host (0 for no limit), and `keepalive_timeout` how long an idle
+    connection is kept. Use :meth:`close` (or the API as an async context
+    manager) to release them.
+    """
+
+    def __init__(self, key=None, url=None, limit=100, limit_per_host=0,
+                 keepalive_timeout=15.):
+        super(AsyncHangaAPI, self).__init__(key=key, url=url)
+        self._connector_options = {
+            "limit": limit,
+            "limit_per_host": limit_per_host,
+            "keepalive_timeout": keepalive_timeout}
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        """Close all the connections kept alive in the pool.
+        """
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    async def submit(self, args, filename, callback=None):
+        """Submit a packaged app to build, see :meth:`hanga.HangaAPI.submit`.
+        The file is read in a thread and streamed to Hanga.
+        """
+        self.ensure_configuration()
+        length = stat(filename).st_size
+        loop = asyncio.get_event_loop()
+
+        async def read_file():
+            index = 0
+            with open(filename, "rb") as fd:
+                while True:
+                    chunk = await loop.run_in_executor(
+                        None, fd.read, BLOCKSIZE)
+                    if not chunk:
+                        break
+                    index += len(chunk)
+                    yield chunk
+                    if callback:
+                        callback(index, length)
+
+        params = {"args": dumps(args)}
+        headers = {"Content-Length": str(length)}
+        async with await self._build_request(
+                "post", "submit", data=read_file(), params=params,
+                headers=headers) as r:
+            return await r.json(content_type=None)
+
+    async def submit_stream(self, args, chunks, callback=None):
+        """Submit a zip produced as chunks, see
+        :meth:`hanga.HangaAPI.submit_stream`. `chunks` can be an iterator,
+        consumed in a thread (like :func:`hanga.pack.iter_pack`), or an
+        async iterator.
+        """
+        self.ensure_configuration()
+        loop = asyncio.get_event_loop()
+
+        async def tracked_chunks():
+            index = 0
+            if hasattr(chunks, "__aiter__"):
+                async for chunk in chunks:
+                    index += len(chunk)
+                    yield chunk
+                    if callback:
+                        callback(index, None)
+                return
+            iterator = iter(chunks)
+            while True:
+                chunk = await loop.run_in_executor(
+                    None, next, iterator, None)
+                if chunk is None:
+                    break
+                index += len(chunk)
+                yield chunk
+                if callback:
+                    callback(index, None)
+
+        params = {"args": dumps(args)}
+        async with await self._build_request(
+                "post", "submit", data=tracked_chunks(),
+                params=params) as r:
+            return await r.json(content_type=None)
+
+    async def download(self, uuid, dest_dir, callback=None):
+        """Download the result of a job build, see
+        :meth:`hanga.HangaAPI.download`. The content is streamed into a
+        `.part` file, renamed once complete.
+
+        Return the name of the filename in the dest_dir.
+        """
+        self.ensure_configuration()
+        async with await self._build_request(
+                "get", "{}/dl".format(uuid)) as r:
+            # ensure the name is shared in the content-disposition
+            disposition = r.headers.get("content-disposition")
+            if not disposition or \
+                    not disposition.startswith("attachment;"):
+                raise HangaException(
+                    "File not attached, nothing to download")
+            filename = disposition.split("filename=", 1)[-1]
+            if not filename:
+                raise HangaException("Empty filename")
+
+            dest_fn = join(dest_dir, filename)
+            part_fn = dest_fn + ".part"
+            index = 0
+            length = int(r.headers.get("Content-Length"))
+            if callback:
+                callback(0, length)
+            with open(part_fn, "wb") as fd:
+                async for content in r.content.iter_chunked(BLOCKSIZE):
+                    fd.write(content)
+                    index += len(content)
+                    if callback:
+                        callback(index, length)
+
+        rename(part_fn, dest_fn)
+        return filename
+
+    async def status(self, uuid, wait=None, since=None):
+        """Return the status of a job, see :meth:`hanga.HangaAPI.status`.
+        """
+        self.ensure_configuration()
+        options = {}
+        if wait:
+            options["timeout"] = aiohttp.ClientTimeout(total=wait + 30)
+        async with await self._build_request(
+                "get", "{}/status".format(uuid),
+                params=self._status_params(wait, since), **options) as r:
+            return await r.json(content_type=None)
+
+    async def iter_status(self, uuid, wait=STATUS_WAIT, poller=None):
+        """Iterate over the status of a job until it's done or in error, see
+        :meth:`hanga.HangaAPI.iter_status`.
+        """
+        poller = poller or StatusPoller()
+        infos = None
+        while True:
+            started = time()
+            previous = infos
+            infos = await self.status(uuid, wait=wait, since=previous)
+            yield infos
+            if infos.get("result") != "ok" or \
+                    infos.get("job_status") in ("done", "error"):
+                return
+            if wait and (status_changed(previous, infos) or
+                         time() - started >= wait / 2.):
+                continue
+            await asyncio.sleep(poller.next_delay(infos))
+
+    async def wait_for_build(self, uuid, callback=None, wait=STATUS_WAIT,
+                             poller=None):
+        """Wait for a build to be done or in error. If a callback is passed,
+        it will be called with each status received.
+
+        Return the last status.
+        """
+        infos = None
+        async for infos in self.iter_status(uuid, wait=wait, poller=poller):
+            if callback:
+                callback(infos)
+        return infos
+
+    async def importkey(self, platform, name, **infos):
+        """Import a key to Hanga, see :meth:`hanga.HangaAPI.importkey`.
+        """
+        params = self._importkey_params(platform, name, infos)
+        self.ensure_configuration()
+        with open(infos["keystore"], "rb") as fd:
+            data = aiohttp.FormData()
+            for key, value in params.items():
+                data.add_field(key, value)
+            data.add_field("keystore-file", fd)
+            async with await self._build_request(
+                    "post", "importkey", data=data) as r:
+                return await r.json(content_type=None)
+
+    async def _build_request(self, method, path, **kwargs):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(**self._connector_options))
+        url = "{}api/1/{}".format(self._url, path)
+        headers = {"X-Hanga-Api": self._key}
+        headers.update(kwargs.pop("headers", {}))
+        r = await self._session.request(
+            method, url, headers=headers, **kwargs)
+        if r.status >= 400:
+            r.release()
+            raise self._request_error(r.status)
+        return r
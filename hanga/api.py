@@ -1,9 +1,19 @@
-import requests
-from hanga.utils import TrackedFile
+from hanga.utils import TrackedFile, UPLOAD_BLOCKSIZE
 from hanga import appdirs
-from json import dumps
-from os import environ, makedirs
+from hanga.poll import StatusPoller, status_changed
+from hanga.stream import (
+    NDJSON_CONTENT_TYPE, SSE_CONTENT_TYPE, iter_stream_events)
+from hashlib import sha256
+from json import dump, dumps, load, loads
+from multiprocessing.pool import ThreadPool
+from os import environ, makedirs, stat, unlink
 from os.path import join, exists
+from threading import Lock
+from time import sleep, time
+try:
+    from os import replace as rename
+except ImportError:
+    from os import rename
 try:
     from configparser import ConfigParser
 except ImportError:
@@ -11,14 +21,32 @@ except ImportError:
 
 
 class HangaException(Exception):
-    pass
-
-
-class HangaAPI(object):
-    """API to communicate with Hanga"""
+    def __init__(self, msg, status_code=None):
+        super(HangaException, self).__init__(msg)
+        self.status_code = status_code
+
+
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+DOWNLOAD_SEGMENT_SIZE = 8 * 1024 * 1024
+DOWNLOAD_WORKERS = 4
+STATUS_WAIT = 30
+# Hanga sends a keep-alive comment at least every 15s on the status stream
+STREAM_TIMEOUT = 60
+STREAM_RECONNECTS = 5
+# errors of the status stream meaning Hanga doesn't support it
+STREAM_UNSUPPORTED = (404, 405, 406)
+# errors not worth retrying, on the stream or by polling
+ACCESS_ERRORS = (401, 403)
+
+
+class BaseHangaAPI(object):
+    """Configuration shared by the Hanga API clients: the API key and the url
+    are taken from the arguments, the environment, or the configuration
+    file.
+    """
 
     def __init__(self, key=None, url=None):
-        super(HangaAPI, self).__init__()
+        super(BaseHangaAPI, self).__init__()
         self.read_configuration()
         c = self.config
 
@@ -38,7 +66,124 @@ class HangaAPI(object):
         self._url = next((x for x in urls if x))
         self._key = next((x for x in keys if x), None)
 
-    def submit(self, args, filename, callback=None):
+    def _request_error(self, status_code):
+        if status_code in (401, 403):
+            msg = "Access denied, invalid HANGA_API_KEY"
+        else:
+            msg = "Request error ({})".format(status_code)
+        return HangaException(msg, status_code=status_code)
+
+    def _importkey_params(self, platform, name, infos):
+        assert(platform == "android")
+        assert(name)
+
+        if platform == "android":
+            assert(infos.get("keystore"))
+            assert(exists(infos.get("keystore")))
+            assert(infos.get("keystore_password"))
+            assert(infos.get("alias"))
+            assert(infos.get("alias_password"))
+
+        return {
+            "platform": platform,
+            "name": name,
+            "keystore-password": infos["keystore_password"],
+            "alias-password": infos["alias_password"],
+            "alias": infos["alias"]}
+
+    def _status_params(self, wait, since):
+        params = {}
+        if wait:
+            params["wait"] = int(wait)
+            if since:
+                params["since"] = "{}:{}".format(
+                    since.get("job_status"), since.get("job_progression"))
+        return params
+
+    def ensure_configuration(self):
+        """
+        Validate that the configuration is ok to call any API commands
+        """
+        if not self._key:
+            raise HangaException("Missing Hanga API Key")
+        if not self._url.endswith("/"):
+            self._url += "/"
+
+    def read_configuration(self):
+        """
+        Read the configuration file. This is already done by the
+        constructor.
+        """
+        self.config = ConfigParser()
+        self.config.read(self.config_fn)
+        if not self.config.has_section("auth"):
+            self.config.add_section("auth")
+
+    def write_configuration(self):
+        """
+        Write the current configuration to the file
+        """
+        with open(self.config_fn, "w") as fd:
+            self.config.write(fd)
+
+    @property
+    def config_fn(self):
+        if not exists(self.user_config_dir):
+            makedirs(self.user_config_dir)
+        return join(self.user_config_dir, 'hanga.conf')
+
+    @property
+    def user_config_dir(self):
+        return appdirs.user_config_dir('Hanga', 'Melting Rocks')
+
+
+class HangaAPI(BaseHangaAPI):
+    """API to communicate with Hanga.
+
+    All the requests are made through a single pooled session: connections
+    are kept alive and reused across calls. `pool_connections` is the number
+    of hosts to keep a pool for, `pool_maxsize` the number of connections
+    kept per host. Use :meth:`close` (or the API as a context manager) to
+    release them.
+    """
+
+    def __init__(self, key=None, url=None, pool_connections=4,
+                 pool_maxsize=8, keep_alive=True, max_retries=0):
+        super(HangaAPI, self).__init__(key=key, url=url)
+        # imported here, the commands without requests start faster
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # one pooled session shared by all the requests, so the connection
+        # to Hanga is kept alive between the submission, the status polling
+        # and the download.
+        self._pool_maxsize = pool_maxsize
+        self._bulk_status = None
+        self._stream_status = None
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=max_retries)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        if not keep_alive:
+            self._session.headers["Connection"] = "close"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close all the connections kept alive in the pool. The API can
+        still be used after, new connections will be opened as needed.
+        """
+        self._session.close()
+
+    def submit(self, args, filename, callback=None,
+               blocksize=UPLOAD_BLOCKSIZE):
         """Submit a packaged app to build. Filename should point on a
         structured zip containing the app, buildozer.spec adjusted for it,
         and others deps if needed. Args should be the line used for building
@@ -58,30 +203,290 @@ class HangaAPI(object):
                 "details": "Something bad happened"
             }
 
+        The file is sent by blocks of `blocksize` bytes, without copying
+        them.
         """
         self.ensure_configuration()
         fd = None
         try:
-            fd = TrackedFile(filename, callback=callback)
+            fd = TrackedFile(filename, callback=callback, blocksize=blocksize)
             params = {"args": dumps(args)}
             r = self._build_request(
-                requests.post, "submit", data=fd, params=params, stream=True)
+                "post", "submit", data=fd, params=params, stream=True)
         finally:
             if fd:
                 fd.close()
 
         return r.json()
 
-    def download(self, uuid, dest_dir, callback=None):
+    def submit_chunked(self, args, filename, callback=None,
+                       part_size=UPLOAD_PART_SIZE, workers=1, retries=3,
+                       upload_id=None):
+        """Same as :meth:`submit`, but the zip is uploaded in parts of
+        `part_size` bytes, `workers` parts at a time. Each part is sent with
+        its sha256 checksum and acknowledged by Hanga, the sha256 of the
+        whole file is given when the upload is created.
+
+        If some parts fail, the upload is resumed from the parts Hanga
+        acknowledged, up to `retries` times. An interrupted upload can also
+        be resumed later by passing its `upload_id`, only with the same file.
+
+        :raise HangaException: if the upload failed, with the `upload_id`
+                               attribute set, or if the file is not the one
+                               of the upload resumed.
+        """
+        from requests.exceptions import RequestException
+        self.ensure_configuration()
+        length = stat(filename).st_size
+        hasher = sha256()
+        with open(filename, "rb") as fd:
+            for block in iter(lambda: fd.read(UPLOAD_BLOCKSIZE), b""):
+                hasher.update(block)
+        digest = hasher.hexdigest()
+        if upload_id is None:
+            infos = self._build_request(
+                "post", "upload",
+                json={"size": length, "part_size": part_size,
+                      "sha256": digest}).json()
+            if infos.get("result") != "ok":
+                return infos
+            upload_id = infos["upload_id"]
+            part_size = infos["part_size"]
+            acknowledged = []
+        else:
+            infos = self.upload_status(upload_id)
+            if infos["size"] != length or \
+                    infos.get("sha256", digest) != digest:
+                raise HangaException(
+                    "{} is not the file of the upload {}".format(
+                        filename, upload_id))
+            part_size = infos["part_size"]
+            acknowledged = infos["parts"]
+
+        count = max(1, (length + part_size - 1) // part_size)
+        progress = {"index": 0}
+        lock = Lock()
+
+        def part_length(index):
+            return min(part_size, length - index * part_size)
+
+        def upload_part(index):
+            with open(filename, "rb") as fd:
+                fd.seek(index * part_size)
+                data = fd.read(part_size)
+            try:
+                self.upload_part(upload_id, index, data)
+            except (HangaException, RequestException):
+                return False
+            with lock:
+                progress["index"] += len(data)
+                if callback:
+                    callback(progress["index"], length)
+            return True
+
+        pool = ThreadPool(workers) if workers > 1 else None
+        try:
+            for attempt in range(retries + 1):
+                missing = sorted(set(range(count)) - set(acknowledged))
+                progress["index"] = length - sum(
+                    part_length(index) for index in missing)
+                if callback:
+                    callback(progress["index"], length)
+                if not missing:
+                    break
+                if pool:
+                    pool.map(upload_part, missing)
+                else:
+                    for index in missing:
+                        if not upload_part(index):
+                            break
+                # what Hanga really have is the reference to resume from
+                acknowledged = self.upload_status(upload_id)["parts"]
+            else:
+                if len(acknowledged) != count:
+                    error = HangaException(
+                        "Upload failed, {} of {} parts received".format(
+                            len(acknowledged), count))
+                    error.upload_id = upload_id
+                    raise error
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+
+        r = self._build_request(
+            "post", "upload/{}/submit".format(upload_id),
+            json={"args": args})
+        return r.json()
+
+    def upload_status(self, upload_id):
+        """Return the status of a chunked upload, in a form of a dictionary::
+
+            {
+                "result": "ok",
+                "size": 18874368,
+                "part_size": 8388608,
+                "sha256": "6e8b...",
+                "parts": [0, 2],
+                "offset": 8388608
+            }
+
+        `parts` are the index of the parts acknowledged, and `offset` the
+        size of the data received without any missing part.
+        """
+        self.ensure_configuration()
+        r = self._build_request("get", "upload/{}".format(upload_id))
+        infos = r.json()
+        if infos.get("result") != "ok":
+            raise HangaException(infos.get("details", "Invalid response"))
+        return infos
+
+    def upload_part(self, upload_id, index, data):
+        """Upload one part of a chunked upload. Hanga verify the checksum
+        before acknowledging it.
+        """
+        self.ensure_configuration()
+        headers = {"X-Hanga-Checksum": sha256(data).hexdigest()}
+        self._build_request(
+            "put", "upload/{}/{}".format(upload_id, index), data=data,
+            headers=headers)
+
+    def submit_stream(self, args, chunks, callback=None):
+        """Same as :meth:`submit`, but the zip is read from an iterator of
+        chunks instead of a file, and sent while being produced, using a
+        chunked transfer encoding. As the total size is unknown, the
+        callback is called with `None` as length.
+        """
+        self.ensure_configuration()
+
+        def tracked_chunks():
+            index = 0
+            for chunk in chunks:
+                index += len(chunk)
+                yield chunk
+                if callback:
+                    callback(index, None)
+
+        params = {"args": dumps(args)}
+        r = self._build_request(
+            "post", "submit", data=tracked_chunks(), params=params)
+        return r.json()
+
+    def submit_delta(self, args, manifest, blobs, callback=None):
+        """Submit an app to build by sending only the files that Hanga
+        doesn't already have.
+
+        `manifest` is a list of the files of the archive, each one in a form
+        of a dictionary::
+
+            {
+                "path": "app/main.py",
+                "sha256": "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b8...",
+                "size": 4
+            }
+
+        `blobs` map each sha256 to the content to upload if Hanga is missing
+        it: either a filename or the content itself as bytes.
+        If a callback is passed, it will be called with the size uploaded
+        and the total size to upload.
+
+        Hanga assembles the archive from the manifest, and the result is the
+        same as :meth:`submit`. If Hanga doesn't support delta submission, a
+        `HangaException` with a 404 `status_code` is raised.
+        """
+        self.ensure_configuration()
+        hashes = sorted(set(entry["sha256"] for entry in manifest))
+        missing = self.missing_blobs(hashes)
+
+        sizes = dict((entry["sha256"], entry["size"]) for entry in manifest)
+        length = sum(sizes[digest] for digest in missing)
+        index = 0
+        if callback:
+            callback(index, length)
+        for digest in missing:
+            self.upload_blob(digest, blobs[digest])
+            index += sizes[digest]
+            if callback:
+                callback(index, length)
+
+        r = self._build_request(
+            "post", "submit/manifest",
+            json={"args": args, "manifest": manifest})
+        return r.json()
+
+    def missing_blobs(self, hashes):
+        """Return the list of the sha256 that Hanga doesn't have yet, from
+        the `hashes` list.
+        """
+        self.ensure_configuration()
+        r = self._build_request(
+            "post", "blobs/missing", json={"hashes": list(hashes)})
+        infos = r.json()
+        if infos.get("result") != "ok":
+            raise HangaException(infos.get("details", "Invalid response"))
+        return infos["missing"]
+
+    def upload_blob(self, digest, content):
+        """Upload one blob to Hanga. `content` is either a filename or the
+        content itself as bytes.
+        """
+        self.ensure_configuration()
+        if isinstance(content, bytes):
+            self._build_request(
+                "put", "blobs/{}".format(digest), data=content)
+            return
+        with open(content, "rb") as fd:
+            self._build_request(
+                "put", "blobs/{}".format(digest), data=fd)
+
+    def lookup_artifact(self, key):
+        """Return the uuid of a job already built by Hanga for a cache key
+        (see :func:`hanga.cache.cache_key`), or None.
+        """
+        self.ensure_configuration()
+        try:
+            r = self._build_request("get", "artifacts/{}".format(key))
+        except HangaException as e:
+            if e.status_code == 404:
+                return None
+            raise
+        infos = r.json()
+        if infos.get("result") != "ok":
+            return None
+        return infos.get("uuid")
+
+    def register_artifact(self, key, uuid):
+        """Associate the job `uuid` to a cache key, so the build result can be
+        reused by anyone building the same application. Return False if
+        Hanga doesn't support it.
+        """
+        self.ensure_configuration()
+        try:
+            self._build_request(
+                "put", "artifacts/{}".format(key), json={"uuid": uuid})
+        except HangaException as e:
+            if e.status_code == 404:
+                return False
+            raise
+        return True
+
+    def download(self, uuid, dest_dir, callback=None,
+                 workers=DOWNLOAD_WORKERS, segment_size=DOWNLOAD_SEGMENT_SIZE):
         """Download the result of a job build. If a callback is passed, it will
         be called with the size of the content received and the total size of
         the content.
 
+        If Hanga accepts ranges, the content is downloaded by segments of
+        `segment_size` bytes, `workers` segments at a time. The segments are
+        written into a `.part` file, next to a `.part.json` keeping the
+        segments done: an interrupted download is resumed from there. The
+        file is renamed to its final name only once complete.
+
         Return the name of the filename in the dest_dir.
         """
         self.ensure_configuration()
-        r = self._build_request(requests.get,
-                                "{}/dl".format(uuid), stream=True)
+        # only the headers, the content is asked by segments if possible
+        r = self._build_request("head", "{}/dl".format(uuid))
 
         # ensure the name is shared in the content-disposition
         disposition = r.headers.get("content-disposition")
@@ -92,20 +497,93 @@ class HangaAPI(object):
             raise HangaException("Empty filename")
 
         dest_fn = join(dest_dir, filename)
-        index = 0
-        length = int(r.headers.get("Content-Length"))
-        if callback:
-            callback(0, length)
-        with open(dest_fn, "wb") as fd:
-            for content in r.iter_content(chunk_size=8192):
-                fd.write(content)
-                index += len(content)
-                if callback:
-                    callback(index, length)
-
+        part_fn = dest_fn + ".part"
+        length = int(r.headers.get("Content-Length") or 0)
+        if r.headers.get("accept-ranges") == "bytes" and length:
+            self._download_segments(
+                uuid, part_fn, length, r.headers.get("etag"), callback,
+                workers, segment_size)
+        else:
+            r = self._build_request("get", "{}/dl".format(uuid), stream=True)
+            length = int(r.headers.get("Content-Length") or 0)
+            index = 0
+            if callback:
+                callback(0, length)
+            with open(part_fn, "wb") as fd:
+                for content in r.iter_content(chunk_size=65536):
+                    fd.write(content)
+                    index += len(content)
+                    if callback:
+                        callback(index, length)
+
+        rename(part_fn, dest_fn)
         return filename
 
-    def status(self, uuid):
+    def _download_segments(self, uuid, part_fn, length, etag, callback,
+                           workers, segment_size):
+        state_fn = part_fn + ".json"
+        state = {
+            "length": length,
+            "etag": etag,
+            "segment_size": segment_size,
+            "segments": []}
+        if exists(part_fn) and exists(state_fn):
+            with open(state_fn) as fd:
+                previous = load(fd)
+            # resume only if it's the same content
+            if all(previous.get(key) == state[key] for key in
+                   ("length", "etag", "segment_size")) and etag:
+                state = previous
+        if not state["segments"]:
+            with open(part_fn, "wb") as fd:
+                fd.truncate(length)
+
+        count = (length + segment_size - 1) // segment_size
+        missing = sorted(set(range(count)) - set(state["segments"]))
+        progress = {"index": length - sum(
+            min(segment_size, length - index * segment_size)
+            for index in missing)}
+        lock = Lock()
+        if callback:
+            callback(progress["index"], length)
+
+        def download_segment(index):
+            start = index * segment_size
+            end = min(start + segment_size, length) - 1
+            headers = {"Range": "bytes={}-{}".format(start, end)}
+            if etag:
+                headers["If-Range"] = etag
+            r = self._build_request(
+                "get", "{}/dl".format(uuid), stream=True, headers=headers)
+            if r.status_code != 206:
+                raise HangaException("Build result changed while downloading")
+            with open(part_fn, "r+b") as fd:
+                fd.seek(start)
+                for content in r.iter_content(chunk_size=65536):
+                    fd.write(content)
+                    with lock:
+                        progress["index"] += len(content)
+                        if callback:
+                            callback(progress["index"], length)
+            with lock:
+                state["segments"].append(index)
+                with open(state_fn, "w") as fd:
+                    dump(state, fd)
+
+        pool = ThreadPool(workers) if workers > 1 else None
+        try:
+            if pool:
+                pool.map(download_segment, missing)
+            else:
+                for index in missing:
+                    download_segment(index)
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+        unlink(state_fn)
+
+    def status(self, uuid, wait=None, since=None):
         """Return the status of a job, in a form of a dictionary::
 
             {
@@ -117,11 +595,179 @@ class HangaAPI(object):
         The `result` can be either "OK" or "error" if something happens.
         The `job_status` can be a lot of things, depending on the Hanga
         version running. It ends only with a status of "done" or "error".
+
+        With `wait`, Hanga can hold the request up to `wait` seconds, until
+        the status is different from the one given in `since` (a previous
+        status dictionary).
         """
         self.ensure_configuration()
-        r = self._build_request(requests.get, "{}/status".format(uuid))
+        options = {}
+        if wait:
+            options["timeout"] = wait + 30
+        r = self._build_request(
+            "get", "{}/status".format(uuid),
+            params=self._status_params(wait, since), **options)
         return r.json()
 
+    def status_many(self, uuids):
+        """Return the status of many jobs at once, in a form of a dictionary
+        indexed by uuid, each value being the same as :meth:`status`.
+
+        All the status are fetched in one request. If Hanga doesn't support
+        it, they are fetched by concurrent requests using the connections
+        of the pool.
+        """
+        self.ensure_configuration()
+        uuids = list(uuids)
+        if not uuids:
+            return {}
+        if self._bulk_status is not False:
+            try:
+                r = self._build_request(
+                    "post", "status", json={"uuids": uuids})
+                infos = r.json()
+                if infos.get("result") != "ok":
+                    raise HangaException(
+                        infos.get("details", "Invalid response"))
+                self._bulk_status = True
+                return infos["statuses"]
+            except HangaException as e:
+                if e.status_code not in (404, 405):
+                    raise
+                self._bulk_status = False
+
+        def single_status(uuid):
+            try:
+                return self.status(uuid)
+            except HangaException as e:
+                return {"result": "error", "details": str(e)}
+
+        pool = ThreadPool(min(self._pool_maxsize, len(uuids)))
+        try:
+            return dict(zip(uuids, pool.map(single_status, uuids)))
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def cancel(self, uuid):
+        """Cancel a job, when a newer build supersedes it. Its status ends
+        with "error". Return False if Hanga doesn't support it.
+        """
+        self.ensure_configuration()
+        try:
+            self._build_request("post", "{}/cancel".format(uuid))
+        except HangaException as e:
+            if e.status_code == 404:
+                return False
+            raise
+        return True
+
+    def stream_status(self, uuids, reconnects=STREAM_RECONNECTS,
+                      reconnect_delay=1.):
+        """Iterate over (uuid, status) each time the status of one of the
+        jobs changes, until they are all done or in error. The status are
+        the same as :meth:`status`, pushed by Hanga as soon as they change
+        on a stream of Server-Sent Events (or of JSON lines).
+
+        If the stream is interrupted or can't be opened (like a 503 from a
+        proxy), it is opened again after `reconnect_delay` seconds (longer
+        after each failure), for the jobs not finished yet.
+
+        :raise HangaException: with the status code 404 if Hanga doesn't
+                               support it, 401 or 403 if the access is
+                               denied, or without status code if the stream
+                               failed `reconnects` times in a row.
+        """
+        from requests.exceptions import RequestException
+        self.ensure_configuration()
+        pending = list(uuids)
+        last = {}
+        failures = 0
+        while pending:
+            r = None
+            try:
+                r = self._build_request(
+                    "get", "status/stream",
+                    params={"uuids": ",".join(pending)},
+                    headers={"Accept": "{}, {}".format(
+                        SSE_CONTENT_TYPE, NDJSON_CONTENT_TYPE)},
+                    stream=True, timeout=STREAM_TIMEOUT)
+                lines = (line.decode("utf-8") for line in
+                         r.iter_lines(chunk_size=None))
+                events = iter_stream_events(
+                    r.headers.get("Content-Type"), lines)
+                for event, data, event_id in events:
+                    if event != "status":
+                        continue
+                    infos = loads(data)
+                    uuid = infos.pop("uuid", None)
+                    if uuid not in pending:
+                        continue
+                    failures = 0
+                    if status_changed(last.get(uuid), infos) or \
+                            infos.get("result") != "ok":
+                        last[uuid] = infos
+                        yield uuid, infos
+                    if infos.get("result") != "ok" or \
+                            infos.get("job_status") in ("done", "error"):
+                        pending.remove(uuid)
+                        if not pending:
+                            return
+            except (RequestException, ValueError):
+                pass
+            except HangaException as e:
+                if e.status_code in STREAM_UNSUPPORTED + ACCESS_ERRORS:
+                    raise
+            finally:
+                if r is not None:
+                    r.close()
+            # the stream ended before the jobs
+            failures += 1
+            if failures > reconnects:
+                raise HangaException("The status stream is unavailable")
+            sleep(reconnect_delay * failures)
+
+    def iter_status(self, uuid, wait=STATUS_WAIT, poller=None, stream=True):
+        """Iterate over the status of a job until it's done or in error, as
+        returned by :meth:`status`.
+
+        With `stream`, the status are pushed by Hanga (see
+        :meth:`stream_status`). If it isn't supported, or the stream can't
+        be kept open, the requests are spaced by a
+        :class:`hanga.poll.StatusPoller`, unless Hanga holds them
+        (long-polling with `wait` seconds).
+        """
+        if stream and self._stream_status is not False:
+            try:
+                for _, infos in self.stream_status([uuid]):
+                    self._stream_status = True
+                    yield infos
+                return
+            except HangaException as e:
+                if e.status_code in ACCESS_ERRORS:
+                    raise
+                if e.status_code in STREAM_UNSUPPORTED:
+                    self._stream_status = False
+                # else the stream keeps failing, poll for this job
+
+        poller = poller or StatusPoller()
+        infos = None
+        while True:
+            started = time()
+            previous = infos
+            infos = self.status(uuid, wait=wait, since=previous)
+            yield infos
+            if infos.get("result") != "ok" or \
+                    infos.get("job_status") in ("done", "error"):
+                return
+
+            # if the request was held, or brought a change, ask again
+            # directly: Hanga will hold the next one.
+            if wait and (status_changed(previous, infos) or
+                         time() - started >= wait / 2.):
+                continue
+            sleep(poller.next_delay(infos))
+
     def importkey(self, platform, name, **infos):
         """Import a key to Hanga. Then you can associate the key to your app.
 
@@ -147,30 +793,14 @@ class HangaAPI(object):
             }
 
         """
-
-        assert(platform == "android")
-        assert(name)
-
-        if platform == "android":
-            assert(infos.get("keystore"))
-            assert(exists(infos.get("keystore")))
-            assert(infos.get("keystore_password"))
-            assert(infos.get("alias"))
-            assert(infos.get("alias_password"))
-
+        params = self._importkey_params(platform, name, infos)
         self.ensure_configuration()
         fd = None
         try:
             fd = open(infos["keystore"], "rb")
-            params = {
-                "platform": platform,
-                "name": name,
-                "keystore-password": infos["keystore_password"],
-                "alias-password": infos["alias_password"],
-                "alias": infos["alias"]}
             files = {"keystore-file": fd}
             r = self._build_request(
-                requests.post, "importkey", data=params, files=files)
+                "post", "importkey", data=params, files=files)
         finally:
             if fd:
                 fd.close()
@@ -179,49 +809,9 @@ class HangaAPI(object):
     def _build_request(self, method, path, **kwargs):
         url = "{}api/1/{}".format(self._url, path)
         headers = {"X-Hanga-Api": self._key}
-        r = method(url, headers=headers, **kwargs)
-        try:
-            r.raise_for_status()
-        except requests.exceptions.HTTPError:
-            if r.status_code:
-                msg = "Access denied, invalid HANGA_API_KEY"
-            else:
-                msg = "Request error ({})".format(r.status_code)
-            raise HangaException(msg)
+        headers.update(kwargs.pop("headers", {}))
+        r = self._session.request(method, url, headers=headers, **kwargs)
+        if r.status_code >= 400:
+            r.close()
+            raise self._request_error(r.status_code)
         return r
-
-    def ensure_configuration(self):
-        """
-        Validate that the configuration is ok to call any API commands
-        """
-        if not self._key:
-            raise HangaException("Missing Hanga API Key")
-        if not self._url.endswith("/"):
-            self._url += "/"
-
-    def read_configuration(self):
-        """
-        Read the configuration file. This is already done by the
-        constructor.
-        """
-        self.config = ConfigParser()
-        self.config.read(self.config_fn)
-        if not self.config.has_section("auth"):
-            self.config.add_section("auth")
-
-    def write_configuration(self):
-        """
-        Write the current configuration to the file
-        """
-        with open(self.config_fn, "w") as fd:
-            self.config.write(fd)
-
-    @property
-    def config_fn(self):
-        if not exists(self.user_config_dir):
-            makedirs(self.user_config_dir)
-        return join(self.user_config_dir, 'hanga.conf')
-
-    @property
-    def user_config_dir(self):
-        return appdirs.user_config_dir('Hanga', 'Melting Rocks')
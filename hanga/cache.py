@@ -0,0 +1,423 @@
+"""
+Local caches of the build results and of the compressed members.
+
+A build result is indexed by a key computed from the manifest of the packed
+application (which includes the buildozer.spec) and the build arguments: if
+nothing changed, the result of the previous build can be reused instead of
+submitting a new one.
+
+The members compressed into the application zip are kept too, so only the
+files modified since the previous build are compressed again.
+"""
+
+from hanga import appdirs
+from hanga.pack import ZIP_STORED
+from hashlib import sha256
+from json import dump, dumps, load
+from os import listdir, makedirs, stat, unlink, utime, walk
+from os.path import basename, exists, getsize, join
+from shutil import copyfile, rmtree
+from threading import Lock
+from time import localtime, time
+from uuid import uuid4
+try:
+    from os import replace as rename
+except ImportError:
+    from os import rename
+
+CACHE_MAX_SIZE = 1024 * 1024 * 1024
+PACK_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+DIGEST_CACHE_MAX_ENTRIES = 100000
+
+
+def cache_key(manifest, args):
+    """Compute the cache key of a build from the manifest of the application
+    (see :meth:`hanga.HangaAPI.submit_delta`) and the build arguments.
+    """
+    files = sorted((entry["path"], entry["sha256"]) for entry in manifest)
+    return sha256(dumps(
+        {"args": args, "files": files}, sort_keys=True).encode(
+            "utf-8")).hexdigest()
+
+
+class ArtifactCache(object):
+    """Cache of the build results, stored in the Hanga user cache directory.
+    Each entry is a directory named by the cache key, containing the build
+    result. When the cache grows over `max_size` bytes, the least recently
+    used entries are evicted.
+    """
+
+    def __init__(self, root=None, max_size=CACHE_MAX_SIZE):
+        super(ArtifactCache, self).__init__()
+        self.root = root or join(
+            appdirs.user_cache_dir('Hanga', 'Melting Rocks'), 'artifacts')
+        self.max_size = max_size
+
+    def get(self, key, dest_dir):
+        """Copy the cached build result of `key` into dest_dir.
+
+        Return the filename in the dest_dir, or None if it's not cached.
+        """
+        entry_dir = join(self.root, key)
+        if not exists(entry_dir):
+            return None
+        filenames = listdir(entry_dir)
+        if len(filenames) != 1:
+            return None
+        filename = filenames[0]
+        dest_fn = join(dest_dir, filename)
+        copyfile(join(entry_dir, filename), dest_fn + ".part")
+        rename(dest_fn + ".part", dest_fn)
+        # mark it as recently used
+        utime(entry_dir, None)
+        return filename
+
+    def put(self, key, filename):
+        """Store a build result in the cache, and evict the least recently
+        used entries if needed.
+        """
+        if not exists(self.root):
+            makedirs(self.root)
+        tmp_dir = join(self.root, ".{}".format(uuid4().hex))
+        makedirs(tmp_dir)
+        copyfile(filename, join(tmp_dir, basename(filename)))
+        entry_dir = join(self.root, key)
+        if exists(entry_dir):
+            rmtree(entry_dir)
+        rename(tmp_dir, entry_dir)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is under
+        its maximum size.
+        """
+        entries = []
+        for name in listdir(self.root):
+            if name.startswith("."):
+                # entry being added
+                continue
+            entry_dir = join(self.root, name)
+            size = 0
+            for root, dirs, files in walk(entry_dir):
+                size += sum(stat(join(root, fn)).st_size for fn in files)
+            entries.append((stat(entry_dir).st_mtime, size, entry_dir))
+
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, entry_dir in sorted(entries):
+            if total <= self.max_size:
+                break
+            rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove all the entries of the cache.
+        """
+        if exists(self.root):
+            rmtree(self.root)
+
+
+class PackCache(object):
+    """Cache of the compressed members of the application zips, stored in the
+    Hanga user cache directory.
+
+    The index maps the path of each file to its size, modification time and
+    crc, and to the blob containing its compressed content. A file unchanged
+    since it was cached (same size and modification time), compressed with
+    the same method and level, is copied from its blob instead of being
+    compressed again. The members stored uncompressed have no blob, their
+    content is read from the file itself. Only the last version of each file
+    is kept, and the least recently used ones are evicted when the blobs
+    exceed `max_size` bytes. The blobs of the entries replaced by another
+    process are removed when the index is merged.
+
+    The large files, packed block by block, are written from their blob and
+    stored while compressed (see :meth:`lookup` and :meth:`open_blob`).
+
+    Used by :func:`hanga.pack.pack`, from many threads. The index is written
+    by :meth:`save`.
+    """
+
+    def __init__(self, root=None, max_size=PACK_CACHE_MAX_SIZE):
+        super(PackCache, self).__init__()
+        self.root = root or join(
+            appdirs.user_cache_dir('Hanga', 'Melting Rocks'), 'members')
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._index = None
+        self._lock = Lock()
+
+    @property
+    def index_fn(self):
+        return join(self.root, "index.json")
+
+    def _read_index(self):
+        try:
+            with open(self.index_fn) as fd:
+                return load(fd)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = self._read_index()
+        return self._index
+
+    def _find(self, filename, st, method, level):
+        # the valid entry of filename, counted as a miss if there is none
+        with self._lock:
+            entry = self.index.get(filename)
+            if entry is None or entry["size"] != st.st_size or \
+                    entry["mtime"] != _mtime(st) or \
+                    entry["method"] != method or entry["level"] != level:
+                self.misses += 1
+                return None
+            entry["used"] = time()
+            return entry
+
+    def _content_fn(self, filename, entry):
+        if entry["blob"]:
+            return join(self.root, entry["blob"])
+        return filename
+
+    def get(self, filename, st, method, level):
+        """Return the cached compression of filename, in the format of
+        :func:`hanga.pack.compress_member`, or None.
+        """
+        entry = self._find(filename, st, method, level)
+        if entry is None:
+            return None
+        try:
+            with open(self._content_fn(filename, entry), "rb") as fd:
+                data = fd.read()
+        except (IOError, OSError):
+            data = None
+        with self._lock:
+            if data is None or len(data) != entry["csize"]:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return (data, entry["crc"], st.st_size, localtime(st.st_mtime)[:6],
+                st.st_mode, entry["cmethod"])
+
+    def lookup(self, filename, st, method, level):
+        """Same as :meth:`get`, without reading the compressed content,
+        for the large files: return a tuple (filename of the compressed
+        content, crc, compressed size, method), or None.
+        """
+        entry = self._find(filename, st, method, level)
+        if entry is None:
+            return None
+        content_fn = self._content_fn(filename, entry)
+        try:
+            valid = getsize(content_fn) == entry["csize"]
+        except OSError:
+            valid = False
+        with self._lock:
+            if not valid:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return content_fn, entry["crc"], entry["csize"], entry["cmethod"]
+
+    def put(self, filename, st, method, level, result):
+        """Store the result of :func:`hanga.pack.compress_member` for
+        filename.
+        """
+        data, crc, size, date_time, mode, cmethod = result
+        blob = None
+        if cmethod != ZIP_STORED:
+            blob, fd = self.open_blob()
+            with fd:
+                fd.write(data)
+        self.put_blob(filename, st, method, level, crc, len(data), cmethod,
+                      blob)
+
+    def open_blob(self):
+        """Create a blob, to write a compressed content while it is
+        produced. Return its name and its file object, to close before
+        :meth:`put_blob` or :meth:`discard_blob`.
+        """
+        if not exists(self.root):
+            makedirs(self.root)
+        blob = uuid4().hex
+        return blob, open(join(self.root, "." + blob), "wb")
+
+    def discard_blob(self, blob):
+        """Remove a blob created by :meth:`open_blob` and not stored.
+        """
+        self._remove_blob("." + blob)
+
+    def put_blob(self, filename, st, method, level, crc, csize, cmethod,
+                 blob=None):
+        """Store the compression of filename, its content being the `blob`
+        created by :meth:`open_blob`, or the file itself if stored.
+        """
+        if not exists(self.root):
+            makedirs(self.root)
+        if blob:
+            rename(join(self.root, "." + blob), join(self.root, blob))
+        with self._lock:
+            previous = self.index.get(filename)
+            self.index[filename] = {
+                "size": st.st_size,
+                "mtime": _mtime(st),
+                "method": method,
+                "level": level,
+                "crc": crc,
+                "csize": csize,
+                "cmethod": cmethod,
+                "blob": blob,
+                "used": time()}
+        if previous and previous["blob"] and previous["blob"] != blob:
+            self._remove_blob(previous["blob"])
+
+    def save(self):
+        """Write the index, merged with the changes made by other processes
+        since it was read, and evict the least recently used entries.
+        """
+        if self._index is None or not exists(self.root):
+            return
+        with self._lock:
+            index = self._read_index()
+            evicted = []
+            for filename, entry in self._index.items():
+                other = index.get(filename)
+                if other is None or other["used"] <= entry["used"]:
+                    index[filename] = entry
+                    loser = other
+                else:
+                    loser = entry
+                # the blob of the entry not kept is referenced by no index
+                if loser and loser["blob"] and \
+                        loser["blob"] != index[filename]["blob"]:
+                    evicted.append(loser["blob"])
+
+            total = sum(entry["csize"] for entry in index.values()
+                        if entry["blob"])
+            for filename, entry in sorted(
+                    index.items(), key=lambda x: x[1]["used"]):
+                if total <= self.max_size:
+                    break
+                del index[filename]
+                if entry["blob"]:
+                    evicted.append(entry["blob"])
+                    total -= entry["csize"]
+
+            tmp_fn = join(self.root, ".index.{}".format(uuid4().hex))
+            with open(tmp_fn, "w") as fd:
+                dump(index, fd)
+            rename(tmp_fn, self.index_fn)
+            self._index = index
+        for blob in evicted:
+            self._remove_blob(blob)
+
+    def _remove_blob(self, blob):
+        try:
+            unlink(join(self.root, blob))
+        except OSError:
+            pass
+
+    def clear(self):
+        """Remove all the entries of the cache.
+        """
+        if exists(self.root):
+            rmtree(self.root)
+        self._index = None
+
+
+class DigestCache(object):
+    """Cache of the sha256 of the application sources, used to build their
+    manifest, stored next to the :class:`PackCache`. The digest of a file is
+    computed again only if its size or modification time changed. The least
+    recently used entries are evicted over `max_entries`.
+
+    Used from many threads. The index is written by :meth:`save`, only if a
+    digest was computed.
+    """
+
+    def __init__(self, root=None, max_entries=DIGEST_CACHE_MAX_ENTRIES):
+        super(DigestCache, self).__init__()
+        self.root = root or join(
+            appdirs.user_cache_dir('Hanga', 'Melting Rocks'), 'members')
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._index = None
+        self._lock = Lock()
+
+    @property
+    def index_fn(self):
+        return join(self.root, "digests.json")
+
+    def _read_index(self):
+        try:
+            with open(self.index_fn) as fd:
+                return load(fd)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = self._read_index()
+        return self._index
+
+    def digest(self, filename, st=None):
+        """Return the sha256 hex digest of filename. `st` is its stat, if
+        already known.
+        """
+        st = st or stat(filename)
+        with self._lock:
+            entry = self.index.get(filename)
+            if entry is not None and entry["size"] == st.st_size and \
+                    entry["mtime"] == _mtime(st):
+                entry["used"] = time()
+                self.hits += 1
+                return entry["sha256"]
+            self.misses += 1
+        hasher = sha256()
+        with open(filename, "rb") as fd:
+            for block in iter(lambda: fd.read(65536), b""):
+                hasher.update(block)
+        digest = hasher.hexdigest()
+        with self._lock:
+            self.index[filename] = {
+                "size": st.st_size,
+                "mtime": _mtime(st),
+                "sha256": digest,
+                "used": time()}
+        return digest
+
+    def save(self):
+        """Write the index, merged with the changes made by other processes
+        since it was read, and evict the least recently used entries.
+        """
+        if self._index is None or not self.misses:
+            return
+        with self._lock:
+            index = self._read_index()
+            for filename, entry in self._index.items():
+                other = index.get(filename)
+                if other is None or other["used"] <= entry["used"]:
+                    index[filename] = entry
+            if len(index) > self.max_entries:
+                evicted = sorted(index, key=lambda x: index[x]["used"])
+                for filename in evicted[:len(index) - self.max_entries]:
+                    del index[filename]
+
+            if not exists(self.root):
+                makedirs(self.root)
+            tmp_fn = join(self.root, ".digests.{}".format(uuid4().hex))
+            with open(tmp_fn, "w") as fd:
+                dump(index, fd)
+            rename(tmp_fn, self.index_fn)
+            self._index = index
+            self.misses = 0
+            self.hits = 0
+
+
+def _mtime(st):
+    # the most precise modification time available
+    return getattr(st, "st_mtime_ns", st.st_mtime)
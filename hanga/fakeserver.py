@@ -0,0 +1,528 @@
+"""
+Hanga stand-in server
+=====================
+
+Local, in-memory implementation of the Hanga API. It is used to try the
+client without the real service::
+
+    python -m hanga.fakeserver --port 8080 --key 0123456789abcdef0123456789abcdef
+
+And then::
+
+    hanga --url http://127.0.0.1:8080/ --api 0123456789abcdef0123456789abcdef android
+
+Builds are simulated: a job goes through a few statuses during `build_time`
+seconds, then the artifact can be downloaded. A `latency` (in seconds, added
+to every request) and a `bandwidth` (in bytes per second, per connection)
+simulate a remote service, for the benchmarks.
+"""
+
+import argparse
+import re
+import socket
+import sys
+import threading
+import zipfile
+from hashlib import sha256
+from io import BytesIO
+from json import dumps, loads
+from random import random
+from time import sleep, time
+from uuid import uuid4
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+
+# size of the blocks transferred when the bandwidth is limited
+THROTTLE_BLOCKSIZE = 64 * 1024
+# delay between two keep-alive comments of the status stream, in seconds
+KEEPALIVE_INTERVAL = 15.
+
+# (progression threshold, status) a simulated build goes through
+BUILD_STEPS = (
+    (0, "queued"),
+    (10, "building"),
+    (80, "packaging"),
+    (100, "done"))
+
+
+class FakeHanga(object):
+    """State of the stand-in: the submitted jobs and the uploaded blobs.
+    """
+
+    def __init__(self, key=None, build_time=5., artifact_size=1024 * 1024,
+                 failure_rate=0., latency=0., bandwidth=0):
+        super(FakeHanga, self).__init__()
+        self.key = key
+        self.build_time = build_time
+        self.artifact_size = artifact_size
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.bandwidth = bandwidth
+        # number of requests received
+        self.requests = 0
+        self.jobs = {}
+        self.blobs = {}
+        self.uploads = {}
+        self.artifacts = {}
+        self.lock = threading.Lock()
+
+    def create_job(self, args, archive):
+        uuid = str(uuid4())
+        with self.lock:
+            self.jobs[uuid] = {
+                "args": args,
+                "archive": archive,
+                "created": time(),
+                "cancelled": None}
+        return uuid
+
+    def create_upload(self, size, part_size, digest=None):
+        upload_id = uuid4().hex
+        with self.lock:
+            self.uploads[upload_id] = {
+                "size": size,
+                "part_size": part_size,
+                "sha256": digest,
+                "parts": {}}
+        return upload_id
+
+    def upload_status(self, upload_id):
+        upload = self.uploads[upload_id]
+        offset = 0
+        while offset // upload["part_size"] in upload["parts"]:
+            offset += len(upload["parts"][offset // upload["part_size"]])
+        status = {
+            "result": "ok",
+            "size": upload["size"],
+            "part_size": upload["part_size"],
+            "parts": sorted(upload["parts"]),
+            "offset": offset}
+        if upload["sha256"]:
+            status["sha256"] = upload["sha256"]
+        return status
+
+    def job_status(self, uuid):
+        job = self.jobs[uuid]
+        if job["cancelled"] is not None:
+            return {
+                "result": "ok",
+                "job_status": "error",
+                "job_progression": job["cancelled"],
+                "details": "Cancelled"}
+        if self.build_time:
+            elapsed = time() - job["created"]
+            progression = min(100, int(elapsed * 100 / self.build_time))
+        else:
+            progression = 100
+        status = [step for threshold, step in BUILD_STEPS
+                  if progression >= threshold][-1]
+        return {
+            "result": "ok",
+            "job_status": status,
+            "job_progression": str(progression)}
+
+    def artifact(self, uuid):
+        """Return the filename and the content of the artifact of a job.
+        """
+        seed = uuid.encode("ascii")
+        content = (seed * (self.artifact_size // len(seed) + 1))
+        return "{}-debug.apk".format(uuid[:8]), content[:self.artifact_size]
+
+    def assemble(self, manifest):
+        """Build the archive of a job from a manifest and the known blobs.
+        """
+        fd = BytesIO()
+        with zipfile.ZipFile(fd, "w") as zfile:
+            for entry in manifest:
+                zfile.writestr(entry["path"], self.blobs[entry["sha256"]])
+        return fd.getvalue()
+
+
+class FakeHangaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # the headers and the content are written separately
+    disable_nagle_algorithm = True
+
+    routes = (
+        ("POST", r"submit", "do_submit"),
+        ("POST", r"submit/manifest", "do_submit_manifest"),
+        ("POST", r"blobs/missing", "do_blobs_missing"),
+        ("PUT", r"blobs/(?P<digest>[0-9a-f]{64})", "do_blob_upload"),
+        ("POST", r"upload", "do_upload_start"),
+        ("GET", r"upload/(?P<upload_id>[0-9a-f]{32})", "do_upload_status"),
+        ("PUT", r"upload/(?P<upload_id>[0-9a-f]{32})/(?P<index>\d+)",
+         "do_upload_part"),
+        ("POST", r"upload/(?P<upload_id>[0-9a-f]{32})/submit",
+         "do_upload_submit"),
+        ("GET", r"(?P<uuid>[0-9a-f-]{36})/status", "do_status"),
+        ("POST", r"(?P<uuid>[0-9a-f-]{36})/cancel", "do_cancel"),
+        ("POST", r"status", "do_status_many"),
+        ("GET", r"status/stream", "do_status_stream"),
+        ("GET", r"(?P<uuid>[0-9a-f-]{36})/dl", "do_download"),
+        ("HEAD", r"(?P<uuid>[0-9a-f-]{36})/dl", "do_download"),
+        ("GET", r"artifacts/(?P<key>[0-9a-f]{64})", "do_artifact_lookup"),
+        ("PUT", r"artifacts/(?P<key>[0-9a-f]{64})", "do_artifact_register"),
+        ("POST", r"importkey", "do_importkey"))
+
+    @property
+    def hanga(self):
+        return self.server.hanga
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_HEAD(self):
+        self.dispatch("HEAD")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PUT(self):
+        self.dispatch("PUT")
+
+    def dispatch(self, method):
+        url = urlparse(self.path)
+        self.query = dict((key, value[-1]) for key, value in
+                          parse_qs(url.query).items())
+        if not url.path.startswith("/api/1/"):
+            return self.send_json({"result": "error"}, 404)
+        path = url.path[len("/api/1/"):]
+        with self.hanga.lock:
+            self.hanga.requests += 1
+        if self.hanga.latency:
+            sleep(self.hanga.latency)
+        for route_method, pattern, handler in self.routes:
+            match = re.match(pattern + "$", path)
+            if route_method != method or not match:
+                continue
+            if self.hanga.key and \
+                    self.headers.get("X-Hanga-Api") != self.hanga.key:
+                return self.send_json({"result": "error"}, 403)
+            return getattr(self, handler)(**match.groupdict())
+        self.send_json({"result": "error"}, 404)
+
+    def read_body(self):
+        if self.headers.get("Transfer-Encoding", "") == "chunked":
+            body = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                body.append(self.read(size))
+                self.rfile.readline()
+                if not size:
+                    return b"".join(body)
+        return self.read(int(self.headers.get("Content-Length", 0)))
+
+    def read(self, size):
+        if not self.hanga.bandwidth:
+            return self.rfile.read(size)
+        blocks = []
+        while size > 0:
+            block = self.rfile.read(min(size, THROTTLE_BLOCKSIZE))
+            if not block:
+                break
+            blocks.append(block)
+            size -= len(block)
+            sleep(len(block) / float(self.hanga.bandwidth))
+        return b"".join(blocks)
+
+    def write(self, content):
+        if not self.hanga.bandwidth:
+            return self.wfile.write(content)
+        for offset in range(0, len(content), THROTTLE_BLOCKSIZE):
+            block = content[offset:offset + THROTTLE_BLOCKSIZE]
+            self.wfile.write(block)
+            sleep(len(block) / float(self.hanga.bandwidth))
+
+    def send_json(self, data, code=200):
+        self.send_content(dumps(data).encode("utf-8"), code=code,
+                          content_type="application/json")
+
+    def send_content(self, content, code=200, content_type=None,
+                     headers=None):
+        self.send_response(code)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if code >= 400:
+            # the request body may not have been read
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.write(content)
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, *args)
+
+    def do_submit(self):
+        archive = self.read_body()
+        args = loads(self.query.get("args", "[]"))
+        uuid = self.hanga.create_job(args, archive)
+        self.send_json({"result": "ok", "uuid": uuid})
+
+    def do_submit_manifest(self):
+        infos = loads(self.read_body().decode("utf-8"))
+        manifest = infos["manifest"]
+        missing = [entry["path"] for entry in manifest
+                   if entry["sha256"] not in self.hanga.blobs]
+        if missing:
+            return self.send_json({
+                "result": "error",
+                "details": "Missing blobs for {}".format(", ".join(missing))})
+        archive = self.hanga.assemble(manifest)
+        uuid = self.hanga.create_job(infos["args"], archive)
+        self.send_json({"result": "ok", "uuid": uuid})
+
+    def do_blobs_missing(self):
+        hashes = loads(self.read_body().decode("utf-8"))["hashes"]
+        missing = [x for x in hashes if x not in self.hanga.blobs]
+        self.send_json({"result": "ok", "missing": missing})
+
+    def do_blob_upload(self, digest):
+        content = self.read_body()
+        if sha256(content).hexdigest() != digest:
+            return self.send_json({"result": "error"}, 400)
+        with self.hanga.lock:
+            self.hanga.blobs[digest] = content
+        self.send_json({"result": "ok"})
+
+    def do_upload_start(self):
+        infos = loads(self.read_body().decode("utf-8"))
+        upload_id = self.hanga.create_upload(
+            infos["size"], infos["part_size"], infos.get("sha256"))
+        self.send_json({
+            "result": "ok",
+            "upload_id": upload_id,
+            "part_size": infos["part_size"]})
+
+    def do_upload_status(self, upload_id):
+        if upload_id not in self.hanga.uploads:
+            return self.send_json({"result": "error"}, 404)
+        self.send_json(self.hanga.upload_status(upload_id))
+
+    def do_upload_part(self, upload_id, index):
+        content = self.read_body()
+        if upload_id not in self.hanga.uploads:
+            return self.send_json({"result": "error"}, 404)
+        if random() < self.hanga.failure_rate:
+            return self.send_json({"result": "error"}, 503)
+        checksum = self.headers.get("X-Hanga-Checksum")
+        if sha256(content).hexdigest() != checksum:
+            return self.send_json({"result": "error"}, 400)
+        with self.hanga.lock:
+            self.hanga.uploads[upload_id]["parts"][int(index)] = content
+        self.send_json({"result": "ok"})
+
+    def do_upload_submit(self, upload_id):
+        infos = loads(self.read_body().decode("utf-8"))
+        upload = self.hanga.uploads.get(upload_id)
+        if upload is None:
+            return self.send_json({"result": "error"}, 404)
+        archive = b"".join(
+            content for index, content in sorted(upload["parts"].items()))
+        if len(archive) != upload["size"]:
+            return self.send_json({
+                "result": "error",
+                "details": "Incomplete upload"})
+        if upload["sha256"] and \
+                sha256(archive).hexdigest() != upload["sha256"]:
+            return self.send_json({
+                "result": "error",
+                "details": "The upload doesn't match its sha256"})
+        del self.hanga.uploads[upload_id]
+        uuid = self.hanga.create_job(infos["args"], archive)
+        self.send_json({"result": "ok", "uuid": uuid})
+
+    def do_status(self, uuid):
+        if uuid not in self.hanga.jobs:
+            return self.send_json({"result": "error"}, 404)
+        # long-polling: hold the request until the status changes
+        deadline = time() + min(float(self.query.get("wait", 0)), 60)
+        since = self.query.get("since")
+        infos = self.hanga.job_status(uuid)
+        while since == "{job_status}:{job_progression}".format(**infos) \
+                and time() < deadline:
+            sleep(0.05)
+            infos = self.hanga.job_status(uuid)
+        self.send_json(infos)
+
+    def do_cancel(self, uuid):
+        if uuid not in self.hanga.jobs:
+            return self.send_json({"result": "error"}, 404)
+        infos = self.hanga.job_status(uuid)
+        if infos["job_status"] not in ("done", "error"):
+            with self.hanga.lock:
+                self.hanga.jobs[uuid]["cancelled"] = infos["job_progression"]
+        self.send_json({"result": "ok"})
+
+    def do_status_stream(self):
+        # Server-Sent Events, or JSON lines if preferred by the client
+        uuids = [x for x in self.query.get("uuids", "").split(",") if x]
+        ndjson = "application/x-ndjson" in self.headers.get("Accept", "") \
+            and "text/event-stream" not in self.headers.get("Accept", "")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson" if ndjson
+                         else "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        sent = {}
+        keepalive = time()
+        while uuids:
+            for uuid in list(uuids):
+                if uuid in self.hanga.jobs:
+                    infos = self.hanga.job_status(uuid)
+                else:
+                    infos = {"result": "error", "details": "Unknown job"}
+                if infos == sent.get(uuid):
+                    continue
+                sent[uuid] = infos
+                data = dict(infos, uuid=uuid)
+                if ndjson:
+                    self.write_chunk(dumps(data) + "\n")
+                else:
+                    self.write_chunk("event: status\ndata: {}\n\n".format(
+                        dumps(data)))
+                keepalive = time()
+                if infos["result"] != "ok" or \
+                        infos["job_status"] in ("done", "error"):
+                    uuids.remove(uuid)
+            if uuids and time() - keepalive >= KEEPALIVE_INTERVAL:
+                self.write_chunk("\n" if ndjson else ": keep-alive\n\n")
+                keepalive = time()
+            if uuids:
+                sleep(0.05)
+        self.write(b"0\r\n\r\n")
+
+    def write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.write("{:x}\r\n".format(len(data)).encode("ascii") + data +
+                   b"\r\n")
+        self.wfile.flush()
+
+    def do_status_many(self):
+        uuids = loads(self.read_body().decode("utf-8"))["uuids"]
+        statuses = {}
+        for uuid in uuids:
+            if uuid in self.hanga.jobs:
+                statuses[uuid] = self.hanga.job_status(uuid)
+            else:
+                statuses[uuid] = {"result": "error", "details": "Unknown job"}
+        self.send_json({"result": "ok", "statuses": statuses})
+
+    def do_download(self, uuid):
+        if uuid not in self.hanga.jobs:
+            return self.send_json({"result": "error"}, 404)
+        filename, content = self.hanga.artifact(uuid)
+        etag = '"{}"'.format(uuid)
+        headers = {
+            "Content-Disposition": "attachment; filename={}".format(
+                filename),
+            "Accept-Ranges": "bytes",
+            "ETag": etag}
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if match and self.headers.get("If-Range", etag) == etag:
+            start = int(match.group(1))
+            end = int(match.group(2) or len(content) - 1)
+            headers["Content-Range"] = "bytes {}-{}/{}".format(
+                start, end, len(content))
+            return self.send_content(
+                content[start:end + 1], code=206,
+                content_type="application/octet-stream", headers=headers)
+        self.send_content(content, content_type="application/octet-stream",
+                          headers=headers)
+
+    def do_artifact_lookup(self, key):
+        if key not in self.hanga.artifacts:
+            return self.send_json({"result": "error"}, 404)
+        self.send_json({"result": "ok", "uuid": self.hanga.artifacts[key]})
+
+    def do_artifact_register(self, key):
+        uuid = loads(self.read_body().decode("utf-8"))["uuid"]
+        if uuid not in self.hanga.jobs:
+            return self.send_json({"result": "error"}, 400)
+        self.hanga.artifacts[key] = uuid
+        self.send_json({"result": "ok"})
+
+    def do_importkey(self):
+        self.read_body()
+        self.send_json({"result": "ok"})
+
+
+class FakeHangaServer(ThreadingMixIn, HTTPServer):
+    """HTTP server of the stand-in. Use :meth:`start` to serve in a
+    background thread, and :attr:`url` to configure the client::
+
+        server = FakeHangaServer(key="0" * 32, build_time=1)
+        server.start()
+        api = HangaAPI(key="0" * 32, url=server.url)
+    """
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), verbose=False, **kwargs):
+        HTTPServer.__init__(self, address, FakeHangaHandler)
+        self.hanga = FakeHanga(**kwargs)
+        self.verbose = verbose
+        self._thread = None
+
+    def handle_error(self, request, client_address):
+        # clients are allowed to close the connection early
+        if not isinstance(sys.exc_info()[1], socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+    @property
+    def url(self):
+        return "http://{}:{}/".format(*self.server_address[:2])
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hanga stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--key", help="API key expected from the clients")
+    parser.add_argument("--build-time", type=float, default=5.,
+                        help="Duration of a simulated build, in seconds")
+    parser.add_argument("--artifact-size", type=int, default=1024 * 1024,
+                        help="Size of the artifact built, in bytes")
+    parser.add_argument("--failure-rate", type=float, default=0.,
+                        help="Probability for an upload part to fail")
+    parser.add_argument("--latency", type=float, default=0.,
+                        help="Delay added to every request, in seconds")
+    parser.add_argument("--bandwidth", type=int, default=0,
+                        help="Transfer rate of each connection, in bytes "
+                        "per second (0 for unlimited)")
+    args = parser.parse_args()
+
+    server = FakeHangaServer(
+        (args.host, args.port), verbose=True, key=args.key,
+        build_time=args.build_time, artifact_size=args.artifact_size,
+        failure_rate=args.failure_rate, latency=args.latency,
+        bandwidth=args.bandwidth)
+    print("Hanga stand-in listening on {}".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,695 @@
+"""
+Zip archive writer used to pack the applications.
+
+The members are read, checksummed and compressed in a pool of workers, then
+written to the archive in the order they were given: the resulting zip is
+the same whatever the number of workers. In reproducible mode, the members
+are also sorted, and their dates and permissions normalized, so the same
+files always give the same archive.
+"""
+
+import bz2
+import struct
+import zlib
+from collections import deque
+from hashlib import sha256
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from os import environ, stat
+from os.path import splitext
+from time import gmtime, localtime, time
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP_BZIP2 = 12
+ZIP_LZMA = 14
+
+METHODS = {
+    "store": ZIP_STORED,
+    "deflate": ZIP_DEFLATED,
+    "bzip2": ZIP_BZIP2,
+    "lzma": ZIP_LZMA}
+
+# version needed to extract, per method
+METHOD_VERSIONS = {
+    ZIP_STORED: 20,
+    ZIP_DEFLATED: 20,
+    ZIP_BZIP2: 46,
+    ZIP_LZMA: 63}
+
+# files already compressed, deflate would only burn CPU on them
+STORED_EXTS = (
+    "png", "jpg", "jpeg", "gif", "webp", "ogg", "oga", "mp3", "m4a", "aac",
+    "opus", "flac", "mp4", "m4v", "webm", "mkv", "avi", "zip", "apk", "jar",
+    "aar", "whl", "egg", "gz", "tgz", "bz2", "xz", "lzma", "7z", "woff",
+    "woff2", "pvr", "etc1", "ktx")
+
+# files mostly made of text, compressing very well
+TEXT_EXTS = (
+    "py", "kv", "txt", "json", "xml", "html", "htm", "css", "js", "csv",
+    "ini", "cfg", "spec", "md", "rst", "po", "atlas", "glsl", "svg", "yaml",
+    "yml")
+
+# under this size, the compression headers cost more than they save
+MIN_COMPRESS_SIZE = 64
+# over this size, the compression level is lowered to save CPU
+LARGE_SIZE = 16 * 1024 * 1024
+# from this size, a member is compressed while it is written, block by block,
+# instead of in memory by the workers
+STREAM_SIZE = 4 * 1024 * 1024
+# size of the members compressed by the workers and not written yet
+MAX_PENDING_SIZE = 32 * 1024 * 1024
+
+# date of the members of the reproducible archives, without SOURCE_DATE_EPOCH
+REPRODUCIBLE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+ZIP64_LIMIT = 0xffffffff
+ZIP_MAX_ENTRIES = 0xffff
+BLOCKSIZE = 1024 * 1024
+
+
+def dos_date_time(date_time):
+    """Convert a (year, month, day, hour, min, sec) tuple to the date and
+    time fields of a zip header.
+    """
+    year, month, day, hour, minute, second = date_time[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    return (((year - 1980) << 9) | (month << 5) | day,
+            (hour << 11) | (minute << 5) | (second // 2))
+
+
+def reproducible_date_time():
+    """Return the date of the members of a reproducible archive: the
+    SOURCE_DATE_EPOCH environment variable if set (see
+    https://reproducible-builds.org/specs/source-date-epoch/), else
+    `REPRODUCIBLE_DATE_TIME`.
+    """
+    epoch = environ.get("SOURCE_DATE_EPOCH")
+    if not epoch:
+        return REPRODUCIBLE_DATE_TIME
+    try:
+        return gmtime(int(epoch))[:6]
+    except ValueError:
+        raise ValueError("Invalid SOURCE_DATE_EPOCH: {!r}".format(epoch))
+
+
+def reproducible_mode(mode):
+    """Return the permissions of a member of a reproducible archive: a
+    regular file, executable by all if its owner could execute it.
+    """
+    if mode & 0o100:
+        return 0o100755
+    return 0o100644
+
+
+class CompressionPolicy(object):
+    """Choose how each member is compressed, from its extension and size.
+
+    Already compressed files (`stored_exts`) and tiny files are stored.
+    Text files are compressed with `text_method` (deflate by default, bzip2
+    or lzma can do better on text-heavy applications), deflated at
+    `text_level` (default to `level`). Others are deflated at `level`,
+    lowered for large files. Whatever the policy, a member compressed in
+    memory (under `STREAM_SIZE`) is stored if the compression doesn't make
+    it smaller.
+
+    :raise ValueError: if a level is not between 1 and 9.
+    """
+
+    def __init__(self, level=6, text_method=ZIP_DEFLATED,
+                 stored_exts=STORED_EXTS, text_exts=TEXT_EXTS,
+                 text_level=None):
+        super(CompressionPolicy, self).__init__()
+        if text_method == ZIP_LZMA and lzma is None:
+            raise ValueError("lzma is not available")
+        if text_level is None:
+            text_level = level
+        for value in (level, text_level):
+            if value not in range(1, 10):
+                raise ValueError(
+                    "Invalid compression level {!r}, expected 1 to "
+                    "9".format(value))
+        self.level = level
+        self.text_level = text_level
+        self.text_method = text_method
+        self.stored_exts = set(stored_exts)
+        self.text_exts = set(text_exts)
+
+    @classmethod
+    def from_config(cls, config, section="hanga"):
+        """Create the policy from a configuration, usually the
+        buildozer.spec::
+
+            [hanga]
+            compression.level = 6
+            compression.text_level = 9
+            compression.text_method = lzma
+            compression.store_exts = dat,bin
+            compression.text_exts = tmx
+
+        The extensions are added to the default ones.
+        """
+        def get(key):
+            if config.has_option(section, key):
+                return config.get(section, key).strip()
+
+        def get_exts(key, default):
+            value = get(key)
+            if not value:
+                return default
+            return tuple(default) + tuple(
+                x.strip().lower() for x in value.split(",") if x.strip())
+
+        def get_level(key):
+            value = get(key)
+            if not value:
+                return None
+            try:
+                return int(value)
+            except ValueError:
+                raise ValueError("Invalid {} {!r}".format(key, value))
+
+        level = get_level("compression.level")
+        text_method = get("compression.text_method")
+        if text_method and text_method not in METHODS:
+            raise ValueError("Unknown compression method {}".format(
+                text_method))
+        return cls(
+            level=6 if level is None else level,
+            text_level=get_level("compression.text_level"),
+            text_method=METHODS[text_method] if text_method
+            else ZIP_DEFLATED,
+            stored_exts=get_exts("compression.store_exts", STORED_EXTS),
+            text_exts=get_exts("compression.text_exts", TEXT_EXTS))
+
+    def file_class(self, arcname):
+        """Return the class of a file, used for the reports: its lowercase
+        extension.
+        """
+        return splitext(arcname)[1][1:].lower() or "(none)"
+
+    def choose(self, arcname, size):
+        """Return the (method, level) to compress a member with.
+        """
+        ext = splitext(arcname)[1][1:].lower()
+        if ext in self.stored_exts or size < MIN_COMPRESS_SIZE:
+            return ZIP_STORED, None
+        if ext in self.text_exts:
+            if self.text_method != ZIP_DEFLATED:
+                return self.text_method, None
+            return ZIP_DEFLATED, self.text_level
+        if size >= LARGE_SIZE:
+            return ZIP_DEFLATED, min(self.level, 3)
+        return ZIP_DEFLATED, self.level
+
+
+def _get_compressor(method, level):
+    # return the compressor and the header to put before the data
+    if method == ZIP_DEFLATED:
+        return zlib.compressobj(level, zlib.DEFLATED, -15), b""
+    if method == ZIP_BZIP2:
+        return bz2.BZ2Compressor(level or 9), b""
+    if method == ZIP_LZMA:
+        # same format as the zipfile module: version, properties size,
+        # properties, then a raw lzma1 stream
+        props = lzma._encode_filter_properties({"id": lzma.FILTER_LZMA1})
+        compressor = lzma.LZMACompressor(lzma.FORMAT_RAW, filters=[
+            lzma._decode_filter_properties(lzma.FILTER_LZMA1, props)])
+        return compressor, struct.pack("<BBH", 9, 4, len(props)) + props
+    return None, b""
+
+
+def compress_member(source, method=ZIP_DEFLATED, level=6):
+    """Read and compress a member. `source` is either a filename or the
+    content itself as bytes. If the compressed content is not smaller, the
+    member is stored.
+
+    :return: a tuple (compressed data, crc, size, date_time, mode, method).
+    """
+    if isinstance(source, bytes):
+        blocks = [source]
+        date_time = localtime(time())
+        mode = 0o644
+    else:
+        st = stat(source)
+        date_time = localtime(st.st_mtime)
+        mode = st.st_mode
+        blocks = _iter_file(source)
+
+    crc = 0
+    size = 0
+    compressor, header = _get_compressor(method, level)
+    if not compressor:
+        data = b"".join(blocks)
+        return (data, zlib.crc32(data) & 0xffffffff, len(data),
+                date_time[:6], mode, ZIP_STORED)
+    data = [header]
+    for block in blocks:
+        crc = zlib.crc32(block, crc)
+        size += len(block)
+        data.append(compressor.compress(block))
+    data.append(compressor.flush())
+    data = b"".join(data)
+    if len(data) >= size:
+        # rare enough to read the file again rather than keeping its content
+        # during the compression
+        data = source if isinstance(source, bytes) else \
+            b"".join(_iter_file(source))
+        return (data, zlib.crc32(data) & 0xffffffff, len(data),
+                date_time[:6], mode, ZIP_STORED)
+    return data, crc & 0xffffffff, size, date_time[:6], mode, method
+
+
+def _iter_file(filename):
+    with open(filename, "rb") as fd:
+        for block in iter(lambda: fd.read(BLOCKSIZE), b""):
+            yield block
+
+
+class ZipWriter(object):
+    """Write a zip archive from already compressed members, or members
+    compressed while they are written (see :meth:`add_stream`). The file
+    object only need to support `write`, the archive is written sequentially.
+    `digest` is the sha256 of the bytes written.
+    """
+
+    def __init__(self, fileobj):
+        super(ZipWriter, self).__init__()
+        self._fd = fileobj
+        self._entries = []
+        self._offset = 0
+        self.digest = sha256()
+
+    def write(self, data):
+        self._fd.write(data)
+        self.digest.update(data)
+        self._offset += len(data)
+
+    def _name_flags(self, arcname, method):
+        try:
+            name = arcname.encode("ascii")
+            flags = 0
+        except UnicodeError:
+            name = arcname.encode("utf-8")
+            flags = 0x800
+        if method == ZIP_LZMA:
+            # the lzma stream is terminated by an end marker
+            flags |= 0x02
+        return name, flags
+
+    def _write_header(self, name, flags, method, date, time_, crc, csize,
+                      size):
+        extra = b""
+        version = METHOD_VERSIONS[method]
+        header_csize, header_size = csize, size
+        if size >= ZIP64_LIMIT or csize >= ZIP64_LIMIT:
+            # the local zip64 extra always contains both sizes
+            extra = struct.pack("<HHQQ", 1, 16, size, csize)
+            version = max(version, 45)
+            header_csize = header_size = ZIP64_LIMIT
+        self.write(struct.pack(
+            "<IHHHHHIIIHH", 0x04034b50, version, flags, method, time_, date,
+            crc, header_csize, header_size, len(name), len(extra)))
+        self.write(name)
+        self.write(extra)
+
+    def add(self, arcname, data, crc, size, method=ZIP_STORED,
+            date_time=(1980, 1, 1, 0, 0, 0), mode=0o644):
+        """Add a member to the archive. `data` is the content already
+        compressed with `method`, `crc` and `size` are the ones of the
+        uncompressed content.
+        """
+        name, flags = self._name_flags(arcname, method)
+        date, time_ = dos_date_time(date_time)
+        csize = len(data)
+        offset = self._offset
+        self._write_header(name, flags, method, date, time_, crc, csize, size)
+        self.write(data)
+
+        self._entries.append((name, flags, method, time_, date, crc, csize,
+                              size, offset, mode))
+
+    def _start_stream(self, arcname, method, date_time, size_hint):
+        # local header of a member followed by a data descriptor, the same
+        # whether it is compressed while written or copied
+        name, flags = self._name_flags(arcname, method)
+        flags |= 0x08
+        date, time_ = dos_date_time(date_time)
+        # leave room for the compression overhead of incompressible data
+        zip64 = size_hint + (size_hint >> 6) + BLOCKSIZE >= ZIP64_LIMIT
+
+        extra = b""
+        version = METHOD_VERSIONS[method]
+        header_size = 0
+        if zip64:
+            # sizes unknown yet, the zip64 extra is there but zeroed
+            extra = struct.pack("<HHQQ", 1, 16, 0, 0)
+            version = max(version, 45)
+            header_size = ZIP64_LIMIT
+        entry = [name, flags, method, time_, date, 0, 0, 0, self._offset]
+        self.write(struct.pack(
+            "<IHHHHHIIIHH", 0x04034b50, version, flags, method, time_, date,
+            0, header_size, header_size, len(name), len(extra)))
+        self.write(name)
+        self.write(extra)
+        return entry, zip64
+
+    def _end_stream(self, arcname, entry, zip64, crc, size, csize, mode):
+        if not zip64 and (size >= ZIP64_LIMIT or csize >= ZIP64_LIMIT):
+            raise ValueError("{} grew over 4 GB while packed".format(arcname))
+        self.write(struct.pack("<IIQQ" if zip64 else "<IIII", 0x08074b50,
+                               crc, csize, size))
+        name, flags, method, time_, date, _, _, _, offset = entry
+        self._entries.append((name, flags, method, time_, date, crc, csize,
+                              size, offset, mode))
+
+    def add_stream(self, arcname, blocks, method=ZIP_STORED, level=None,
+                   date_time=(1980, 1, 1, 0, 0, 0), mode=0o644, size_hint=0,
+                   copy=None):
+        """Add a member from an iterable of uncompressed `blocks`, each one
+        compressed and written before the next one is read: the crc and the
+        sizes are written after the data, in a data descriptor. `size_hint`
+        is the expected size, choosing whether zip64 is needed. The
+        compressed content is also written to the `copy` file object, if
+        any.
+
+        This is a generator, yielding (crc, size, compressed size) of the
+        content written after each block, to be exhausted to complete the
+        member.
+        """
+        entry, zip64 = self._start_stream(arcname, method, date_time,
+                                          size_hint)
+        compressor, header = _get_compressor(method, level)
+        crc = 0
+        size = 0
+        csize = len(header)
+        self.write(header)
+        if copy is not None:
+            copy.write(header)
+        for block in blocks:
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+            data = compressor.compress(block) if compressor else block
+            self.write(data)
+            if copy is not None:
+                copy.write(data)
+            csize += len(data)
+            yield crc & 0xffffffff, size, csize
+        if compressor:
+            data = compressor.flush()
+            self.write(data)
+            if copy is not None:
+                copy.write(data)
+            csize += len(data)
+        crc &= 0xffffffff
+        self._end_stream(arcname, entry, zip64, crc, size, csize, mode)
+        yield crc, size, csize
+
+    def add_compressed_stream(self, arcname, blocks, crc, size, csize,
+                              method=ZIP_STORED,
+                              date_time=(1980, 1, 1, 0, 0, 0), mode=0o644):
+        """Add a member from an iterable of `blocks` already compressed with
+        `method`, of `csize` bytes in total, like the copy made by
+        :meth:`add_stream`: the member is written the same way, so the
+        archive doesn't depend on where the content comes from.
+
+        This is a generator, yielding after each block written, to be
+        exhausted to complete the member.
+        """
+        entry, zip64 = self._start_stream(arcname, method, date_time, size)
+        written = 0
+        for block in blocks:
+            self.write(block)
+            written += len(block)
+            yield
+        if written != csize:
+            raise ValueError("{} changed while packed".format(arcname))
+        self._end_stream(arcname, entry, zip64, crc, size, csize, mode)
+
+    def close(self):
+        """Write the central directory. The file object is not closed.
+        """
+        cd_offset = self._offset
+        for (name, flags, method, time_, date, crc, csize, size, offset,
+                mode) in self._entries:
+            zip64 = [x for x in (size, csize, offset) if x >= ZIP64_LIMIT]
+            extra = b""
+            version = METHOD_VERSIONS[method]
+            if zip64:
+                extra = struct.pack(
+                    "<HH" + "Q" * len(zip64), 1, 8 * len(zip64), *zip64)
+                version = max(version, 45)
+            self.write(struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014b50, (3 << 8) | version,
+                version, flags, method, time_, date, crc,
+                min(csize, ZIP64_LIMIT), min(size, ZIP64_LIMIT),
+                len(name), len(extra), 0, 0, 0, (mode & 0xffff) << 16,
+                min(offset, ZIP64_LIMIT)))
+            self.write(name)
+            self.write(extra)
+
+        cd_size = self._offset - cd_offset
+        count = len(self._entries)
+        if (count > ZIP_MAX_ENTRIES or cd_size >= ZIP64_LIMIT or
+                cd_offset >= ZIP64_LIMIT):
+            zip64_offset = self._offset
+            self.write(struct.pack(
+                "<IQHHIIQQQQ", 0x06064b50, 44, (3 << 8) | 45, 45, 0, 0,
+                count, count, cd_size, cd_offset))
+            self.write(struct.pack("<IIQI", 0x07064b50, 0, zip64_offset, 1))
+        self.write(struct.pack(
+            "<IHHHHIIH", 0x06054b50, 0, 0, min(count, ZIP_MAX_ENTRIES),
+            min(count, ZIP_MAX_ENTRIES), min(cd_size, ZIP64_LIMIT),
+            min(cd_offset, ZIP64_LIMIT), 0))
+
+
+def pack(members, fileobj, workers=None, policy=None, stats=None,
+         cache=None, reproducible=False):
+    """Pack the members into a zip written to `fileobj`. `members` is an
+    iterable of (source, name in the archive), where source is either a
+    filename or the content as bytes.
+
+    Members are compressed in parallel by `workers` threads (default to the
+    number of CPUs), at most 2 per worker and `MAX_PENDING_SIZE` bytes are
+    kept in memory at the same time. The members of `STREAM_SIZE` bytes or
+    more are not compressed by the workers: they are compressed block by
+    block by the calling thread, while they are written. The compression of
+    each member is chosen by the `policy` (a :class:`CompressionPolicy`). If
+    a `stats` dictionary is passed, it is filled with a :class:`PackStats`
+    per file class. With a `cache` (a :class:`hanga.cache.PackCache`), the
+    files unchanged since they were cached are not compressed again. If
+    `reproducible` is set, the members are sorted by name, dated by
+    :func:`reproducible_date_time` and their permissions normalized by
+    :func:`reproducible_mode`.
+
+    :return: the sha256 hex digest of the archive.
+    """
+    writer = ZipWriter(fileobj)
+    for _ in _pack_members(members, writer, workers, policy, stats, cache,
+                           reproducible):
+        pass
+    return writer.digest.hexdigest()
+
+
+def iter_pack(members, workers=None, policy=None, stats=None, cache=None,
+              reproducible=False):
+    """Same as :func:`pack`, but the zip is produced as an iterator of
+    chunks, each one available as soon as its member (or its block, for the
+    large members) is compressed. Nothing is written on the disk.
+    """
+    buf = _ChunkBuffer()
+    writer = ZipWriter(buf)
+    for _ in _pack_members(members, writer, workers, policy, stats, cache,
+                           reproducible):
+        chunk = buf.take()
+        if chunk:
+            yield chunk
+
+
+class PackStats(object):
+    """Number of files, size and compressed size of a class of files.
+    """
+
+    def __init__(self):
+        super(PackStats, self).__init__()
+        self.count = 0
+        self.size = 0
+        self.csize = 0
+
+    @property
+    def ratio(self):
+        return float(self.csize) / self.size if self.size else 1.
+
+
+def format_stats(stats):
+    """Return the lines of a report of the compression per file class, the
+    biggest classes first.
+    """
+    line = "{:<10} {:>6} files {:>12} -> {:>12} bytes ({:.0%})"
+    lines = []
+    total = PackStats()
+    for name, stat_ in sorted(stats.items(), key=lambda x: -x[1].size):
+        total.count += stat_.count
+        total.size += stat_.size
+        total.csize += stat_.csize
+        lines.append(line.format(
+            name, stat_.count, stat_.size, stat_.csize, stat_.ratio))
+    lines.append(line.format(
+        "total", total.count, total.size, total.csize, total.ratio))
+    return lines
+
+
+class _ChunkBuffer(object):
+    def __init__(self):
+        super(_ChunkBuffer, self).__init__()
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(data)
+
+    def take(self):
+        chunk = b"".join(self._chunks)
+        self._chunks = []
+        return chunk
+
+
+def _source_size(source):
+    if isinstance(source, bytes):
+        return len(source)
+    return stat(source).st_size
+
+
+def _compress_cached(source, method, level, cache):
+    if cache is None or isinstance(source, bytes):
+        return compress_member(source, method, level)
+    st = stat(source)
+    result = cache.get(source, st, method, level)
+    if result is None:
+        result = compress_member(source, method, level)
+        cache.put(source, st, method, level, result)
+    return result
+
+
+def _write_streamed(writer, arcname, source, st, method, level, date_time,
+                    mode, cache):
+    # write a large member block by block, from its blob in the cache if
+    # it is there, else compressing it into a new blob. Yield after each
+    # block, then the compressed size.
+    found = None
+    if cache is not None:
+        found = cache.lookup(source, st, method, level)
+    if found is not None:
+        content_fn, crc, csize, cmethod = found
+        for _ in writer.add_compressed_stream(
+                arcname, _iter_file(content_fn), crc, st.st_size, csize,
+                cmethod, date_time, mode):
+            yield
+        yield csize
+        return
+
+    blob = copy = None
+    if cache is not None and method != ZIP_STORED:
+        blob, copy = cache.open_blob()
+    crc = size = csize = 0
+    try:
+        for crc, size, csize in writer.add_stream(
+                arcname, _iter_file(source), method, level, date_time, mode,
+                st.st_size, copy):
+            yield
+    except BaseException:
+        if copy is not None:
+            copy.close()
+            cache.discard_blob(blob)
+        raise
+    if copy is not None:
+        copy.close()
+    if cache is not None:
+        if size == st.st_size:
+            cache.put_blob(source, st, method, level, crc, csize, method,
+                           blob)
+        elif blob:
+            cache.discard_blob(blob)
+    yield csize
+
+
+def _pack_members(members, writer, workers, policy, stats, cache,
+                  reproducible=False):
+    # yield after each member written, and once the archive is complete
+    policy = policy or CompressionPolicy()
+    if reproducible:
+        fixed_date_time = reproducible_date_time()
+        members = sorted(members, key=lambda x: x[1])
+    workers = workers or cpu_count()
+    pool = ThreadPool(workers) if workers > 1 else None
+    # (arcname, size, streamed, result or (source, method, level))
+    pending = deque()
+
+    def count(arcname, size, csize):
+        if stats is not None:
+            stat_ = stats.setdefault(policy.file_class(arcname), PackStats())
+            stat_.count += 1
+            stat_.size += size
+            stat_.csize += csize
+
+    def write_pending():
+        arcname, size, streamed, result = pending.popleft()
+        if streamed:
+            source, method, level = result
+            st = stat(source)
+            date_time = localtime(st.st_mtime)[:6]
+            mode = st.st_mode
+            if reproducible:
+                date_time = fixed_date_time
+                mode = reproducible_mode(mode)
+            for csize in _write_streamed(writer, arcname, source, st, method,
+                                         level, date_time, mode, cache):
+                yield
+            count(arcname, st.st_size, csize)
+            return
+        data, crc, size, date_time, mode, method = \
+            result.get() if pool else result
+        if reproducible:
+            date_time = fixed_date_time
+            mode = reproducible_mode(mode)
+        writer.add(arcname, data, crc, size, method, date_time, mode)
+        count(arcname, size, len(data))
+        yield
+
+    def must_write():
+        if not pending:
+            return False
+        return (not pool or len(pending) > workers * 2 or
+                sum(x[1] for x in pending) > MAX_PENDING_SIZE)
+
+    try:
+        for source, arcname in members:
+            size = _source_size(source)
+            method, level = policy.choose(arcname, size)
+            if size >= STREAM_SIZE and not isinstance(source, bytes):
+                # written from the file by the main thread, nothing in memory
+                pending.append((arcname, 0, True, (source, method, level)))
+            elif pool:
+                pending.append((arcname, size, False, pool.apply_async(
+                    _compress_cached, (source, method, level, cache))))
+            else:
+                pending.append((arcname, size, False, _compress_cached(
+                    source, method, level, cache)))
+            while must_write():
+                for _ in write_pending():
+                    yield
+        while pending:
+            for _ in write_pending():
+                yield
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+    writer.close()
+    if cache is not None:
+        cache.save()
+    yield
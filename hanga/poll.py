@@ -0,0 +1,53 @@
+"""
+Delay policy used to poll the status of a build.
+"""
+
+from random import uniform
+
+
+class StatusPoller(object):
+    """Compute the delay to wait before requesting the status of a job
+    again.
+
+    While the status doesn't change (like when the job is queued), the delay
+    grows exponentially from `min_delay` up to `max_delay`. It is reset when
+    the status changes, and tightened as the progression approaches 100, so
+    the end of the build is noticed quickly. A random `jitter` (as a ratio of
+    the delay) avoids many clients polling at the same time.
+    """
+
+    def __init__(self, min_delay=1., max_delay=30., factor=1.5, jitter=0.2):
+        super(StatusPoller, self).__init__()
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self._status = None
+        self._delay = min_delay
+
+    def next_delay(self, infos):
+        """Return the delay in seconds before the next request, from the
+        last status received.
+        """
+        status = infos.get("job_status")
+        progression = int(infos.get("job_progression") or 0)
+        if status != self._status:
+            self._status = status
+            self._delay = self.min_delay
+        else:
+            self._delay = min(self._delay * self.factor, self.max_delay)
+
+        delay = self._delay
+        if progression:
+            remaining = self.max_delay * (100 - progression) / 100.
+            delay = min(delay, max(self.min_delay, remaining))
+        return delay * uniform(1 - self.jitter, 1 + self.jitter)
+
+
+def status_changed(previous, infos):
+    """Return True if the status or the progression of a job changed between
+    two status dictionaries (`previous` can be None).
+    """
+    return previous is None or any(
+        infos.get(key) != previous.get(key)
+        for key in ("job_status", "job_progression"))
@@ -0,0 +1,198 @@
+"""
+Progress of the transfers and of the builds.
+
+The API callbacks are called for every block sent or received, which is far
+too often to redraw a progress bar. A :class:`ProgressBus` aggregates them,
+and publishes :class:`ProgressEvent` to its subscribers at a bounded rate::
+
+    bus = ProgressBus()
+    bus.subscribe(print)
+    upload = bus.phase("upload")
+    api.submit(["android"], "app.zip", callback=upload)
+    upload.finish()
+"""
+
+from json import dumps
+from threading import Lock
+from time import time
+
+
+class ProgressEvent(object):
+    """Progress of a phase ("upload", "download" or "build"): `current` out
+    of `total` (bytes, or percents for the build; None if unknown),
+    `elapsed` seconds since the phase started. `status` is the job status
+    for the build phase, and `finished` is set on the last event.
+    """
+
+    __slots__ = ("phase", "current", "total", "elapsed", "status",
+                 "finished")
+
+    def __init__(self, phase, current, total, elapsed, status=None,
+                 finished=False):
+        super(ProgressEvent, self).__init__()
+        self.phase = phase
+        self.current = current
+        self.total = total
+        self.elapsed = elapsed
+        self.status = status
+        self.finished = finished
+
+    @property
+    def rate(self):
+        """Average rate since the start of the phase, per second.
+        """
+        if not self.elapsed:
+            return 0.
+        return self.current / self.elapsed
+
+    def as_dict(self):
+        return dict((key, getattr(self, key)) for key in self.__slots__)
+
+
+class ProgressPhase(object):
+    """Callback of the API for one phase, as returned by
+    :meth:`ProgressBus.phase`: called with (current, total), it publishes an
+    event if the last one is older than the bus `interval`, and the progress
+    moved by at least `step` (a ratio of the total) or the last event is
+    older than `max_interval`.
+    """
+
+    def __init__(self, bus, name):
+        super(ProgressPhase, self).__init__()
+        self.bus = bus
+        self.name = name
+        self.current = 0
+        self.total = None
+        self.started = time()
+        self._lock = Lock()
+        self._published = None
+        self._published_at = 0
+
+    def __call__(self, current, total):
+        if total == 0:
+            return
+        with self._lock:
+            self.current = current
+            self.total = total
+            now = time()
+            elapsed = now - self._published_at
+            if elapsed < self.bus.interval:
+                return
+            if total and self._published is not None and \
+                    current - self._published < total * self.bus.step and \
+                    elapsed < self.bus.max_interval:
+                return
+            self._publish(now)
+
+    def finish(self):
+        """Publish the last event of the phase, if it started.
+        """
+        with self._lock:
+            if self._published is not None or self.current:
+                self._publish(time(), finished=True)
+
+    def _publish(self, now, **kwargs):
+        self._published = self.current
+        self._published_at = now
+        self.bus.publish(ProgressEvent(
+            self.name, self.current, self.total, now - self.started,
+            **kwargs))
+
+
+class ProgressBus(object):
+    """Publish the progress events to the subscribers, at most one per
+    `interval` seconds and per phase.
+    """
+
+    def __init__(self, interval=0.1, step=0.005, max_interval=1.):
+        super(ProgressBus, self).__init__()
+        self.interval = interval
+        self.step = step
+        self.max_interval = max_interval
+        self._subscribers = []
+        self._build = None
+
+    def subscribe(self, subscriber):
+        """Call `subscriber` with each :class:`ProgressEvent` published.
+        """
+        self._subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.remove(subscriber)
+
+    def publish(self, event):
+        for subscriber in self._subscribers:
+            subscriber(event)
+
+    def phase(self, name):
+        """Return a new :class:`ProgressPhase`, to pass as the callback of
+        an API call.
+        """
+        return ProgressPhase(self, name)
+
+    def status(self, infos):
+        """Publish the progression of a build from its status. Unlike the
+        transfers, every status is published.
+        """
+        if self._build is None:
+            self._build = time()
+        finished = infos.get("result") != "ok" or \
+            infos.get("job_status") in ("done", "error")
+        self.publish(ProgressEvent(
+            "build", int(infos.get("job_progression") or 0), 100,
+            time() - self._build, status=infos.get("job_status"),
+            finished=finished))
+        if finished:
+            self._build = None
+
+
+class JsonProgressLog(object):
+    """Write events as lines of JSON (NDJSON) into `fileobj`. As a
+    subscriber of a :class:`ProgressBus`, the transfers are written as
+    "progress" events, and the builds as "status" events when their status
+    or progression changes. The `context` (like the uuid of the build) is
+    added to every event.
+    """
+
+    def __init__(self, fileobj):
+        super(JsonProgressLog, self).__init__()
+        self.fileobj = fileobj
+        self.context = {}
+        self._lock = Lock()
+        self._status = None
+
+    def emit(self, event, **data):
+        """Write an event, named by `event`, with its data.
+        """
+        for key, value in self.context.items():
+            data.setdefault(key, value)
+        data["event"] = event
+        line = dumps(data, sort_keys=True) + "\n"
+        with self._lock:
+            self.fileobj.write(line)
+            self.fileobj.flush()
+
+    def __call__(self, event):
+        if event.phase != "build":
+            self.emit("progress", **event.as_dict())
+            return
+        status = (event.status, event.current)
+        if status != self._status:
+            self._status = status
+            self.emit("status", status=event.status,
+                      progression=event.current, elapsed=event.elapsed)
+        if event.finished:
+            self._status = None
+
+
+class ProgressMetrics(object):
+    """Subscriber keeping the last event of each phase, to report the
+    transfer rates.
+    """
+
+    def __init__(self):
+        super(ProgressMetrics, self).__init__()
+        self.phases = {}
+
+    def __call__(self, event):
+        self.phases[event.phase] = event
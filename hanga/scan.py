@@ -0,0 +1,181 @@
+"""
+Scanner of the application sources.
+
+Select the files of the application like Buildozer does, from the
+`source.include_exts`, `source.exclude_exts`, `source.exclude_dirs`,
+`source.exclude_patterns` and `source.include_patterns` tokens. Hidden and
+excluded directories (like `.git` or `.buildozer`) are pruned instead of
+being walked, and the stat of each file is kept from the scan.
+"""
+
+from fnmatch import fnmatch
+from os import stat
+from os.path import join, splitext
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+class _DirEntry(object):
+    # minimal DirEntry, for Python without scandir
+    def __init__(self, directory, name):
+        super(_DirEntry, self).__init__()
+        self.name = name
+        self.path = join(directory, name)
+        self._stat = None
+
+    def stat(self):
+        if self._stat is None:
+            self._stat = stat(self.path)
+        return self._stat
+
+    def is_dir(self):
+        try:
+            return self.stat().st_mode & 0o170000 == 0o040000
+        except OSError:
+            return False
+
+
+def _scandir(directory):
+    if scandir is not None:
+        return scandir(directory)
+    from os import listdir
+    return [_DirEntry(directory, name) for name in listdir(directory)]
+
+
+class SourceScanner(object):
+    """Scan the files of an application in `source_dir`, filtered with the
+    Buildozer rules.
+
+    The number of files and directories skipped is counted per rule in
+    :attr:`skipped`.
+    """
+
+    def __init__(self, source_dir, include_exts=(), exclude_exts=(),
+                 exclude_dirs=(), exclude_patterns=(), include_patterns=()):
+        super(SourceScanner, self).__init__()
+        self.source_dir = source_dir
+        self.include_exts = [x.lower() for x in include_exts]
+        self.exclude_exts = [x.lower() for x in exclude_exts]
+        self.exclude_dirs = [
+            x.lower() if x.endswith("/") else x.lower() + "/"
+            for x in exclude_dirs]
+        self.exclude_patterns = [x.lower() for x in exclude_patterns]
+        self.include_patterns = [x.lower() for x in include_patterns]
+        self.skipped = {}
+
+    @classmethod
+    def from_config(cls, config, source_dir):
+        """Create the scanner from the [app] section of a buildozer.spec.
+        """
+        def getlist(key):
+            return config.getlist("app", key, "")
+
+        return cls(
+            source_dir,
+            include_exts=getlist("source.include_exts"),
+            exclude_exts=getlist("source.exclude_exts"),
+            exclude_dirs=getlist("source.exclude_dirs"),
+            exclude_patterns=getlist("source.exclude_patterns"),
+            include_patterns=getlist("source.include_patterns"))
+
+    def scan(self):
+        """Iterate over the files selected, as tuples (filename, relative
+        name with "/" as separator, stat result).
+        """
+        self.skipped = {}
+        directories = [(self.source_dir, "")]
+        while directories:
+            directory, rel_dir = directories.pop()
+            files = []
+            subdirs = []
+            for entry in _scandir(directory):
+                if entry.is_dir():
+                    subdirs.append(entry)
+                else:
+                    files.append(entry)
+
+            for entry in sorted(subdirs, key=lambda x: x.name, reverse=True):
+                reason = self._prune_reason(entry.name, rel_dir)
+                if reason:
+                    self._skip(reason + " (directories)")
+                    continue
+                directories.append((entry.path, rel_dir + entry.name + "/"))
+
+            reason = self._dir_reason(rel_dir.lower())
+            if reason:
+                # the directory itself is excluded, but not necessarily its
+                # subdirectories
+                for entry in files:
+                    self._skip(reason)
+                continue
+
+            for entry in sorted(files, key=lambda x: x.name):
+                reason = self._file_reason(entry.name, rel_dir.lower())
+                if reason:
+                    self._skip(reason)
+                    continue
+                yield entry.path, rel_dir + entry.name, entry.stat()
+
+    def _skip(self, reason):
+        self.skipped[reason] = self.skipped.get(reason, 0) + 1
+
+    def _prune_reason(self, name, rel_dir):
+        if name.startswith("."):
+            return "hidden"
+        if self.include_patterns:
+            # a subdirectory can be included back by a pattern
+            return
+        if self._excluded_dir((rel_dir + name).lower() + "/"):
+            return "exclude_dirs"
+
+    def _excluded_dir(self, filtered_dir):
+        for exclude_dir in self.exclude_dirs:
+            if filtered_dir.startswith(exclude_dir):
+                return True
+        return False
+
+    def _dir_reason(self, filtered_dir):
+        if not filtered_dir:
+            return
+        if self._excluded_dir(filtered_dir):
+            reason = "exclude_dirs"
+        elif self._match_patterns(filtered_dir):
+            reason = "exclude_patterns"
+        else:
+            return
+        for pattern in self.include_patterns:
+            if fnmatch(filtered_dir, pattern):
+                return
+        return reason
+
+    def _match_patterns(self, name):
+        # exclude_patterns, unless matched back by include_patterns
+        excluded = False
+        for pattern in self.exclude_patterns:
+            if fnmatch(name, pattern):
+                excluded = True
+                break
+        if excluded:
+            for pattern in self.include_patterns:
+                if fnmatch(name, pattern):
+                    return False
+        return excluded
+
+    def _file_reason(self, fn, filtered_dir):
+        if fn.startswith("."):
+            return "hidden"
+        if self._match_patterns(filtered_dir + fn if filtered_dir
+                                else fn.lower()):
+            return "exclude_patterns"
+        ext = splitext(fn)[1]
+        if ext:
+            ext = ext[1:].lower()
+            if self.include_exts and ext not in self.include_exts:
+                return "include_exts"
+            if self.exclude_exts and ext in self.exclude_exts:
+                return "exclude_exts"
@@ -0,0 +1,311 @@
+"""
+Hanga agent.
+
+A daemon listening on a Unix socket, keeping the connections to Hanga, the
+pack and digest caches and Buildozer loaded between the commands. The builds
+submitted are queued, packed and uploaded by `concurrency` workers, and their
+status is checked for all of them in one request, like a batch that never
+ends. See :mod:`hanga.agent` for the protocol and the client.
+"""
+
+from __future__ import print_function
+import hanga
+import os
+import socket
+import sys
+from hanga import __version__
+from hanga.pack import iter_pack
+from hanga.scripts.batch import BatchBuild, BatchRunner, build_summary
+from json import dumps, loads
+from multiprocessing.pool import ThreadPool
+from os import getpid, unlink
+from os.path import dirname, exists
+from threading import Event, Lock, Thread
+from time import sleep, time
+try:
+    from queue import Queue
+    from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+except ImportError:
+    from Queue import Queue
+    from SocketServer import StreamRequestHandler, ThreadingUnixStreamServer
+
+# options of the command line a request can set for its build
+BUILD_ARGUMENTS = (
+    "--profile", "--workers", "--reproducible", "--copy-sources",
+    "--no-pack-cache", "--delta", "--stream")
+# delay between two status checks when no build is waiting, in seconds
+IDLE_DELAY = 5.
+# delay between two messages to a client waiting for a build, in seconds
+WAIT_INTERVAL = 0.2
+# finished builds kept for the "builds" request
+MAX_FINISHED = 100
+
+
+class AgentBuild(BatchBuild):
+    """A build queued in the agent, with the options of its request.
+    """
+
+    def __init__(self, spec_fn, args, arguments):
+        super(AgentBuild, self).__init__(spec_fn)
+        self.args = args
+        self.arguments = arguments
+        self.id = None
+
+
+class Agent(BatchRunner):
+    """Run the builds submitted to the agent. `client_factory` creates the
+    :class:`HangaClient` of a buildozer.spec with the options of its
+    request.
+    """
+
+    def __init__(self, api, client_factory, concurrency=4):
+        super(Agent, self).__init__(api, client_factory,
+                                    concurrency=concurrency)
+        self.builds = []
+        self._count = 0
+        self._queue = Queue()
+        self._wakeup = Event()
+        self._stopping = Event()
+        self._builds_lock = Lock()
+        self._download_pool = ThreadPool(concurrency)
+        self._threads = [Thread(target=self._work)
+                         for _ in range(concurrency)]
+        self._threads.append(Thread(target=self._monitor))
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def queue(self, spec_fn, args, arguments):
+        """Queue a build, and return its :class:`AgentBuild`.
+        """
+        build = AgentBuild(spec_fn, args, arguments)
+        build.status = "queued"
+        with self._builds_lock:
+            self._count += 1
+            build.id = self._count
+            self.builds.append(build)
+            finished = [x for x in self.builds if x.finished]
+            for old in finished[:len(finished) - MAX_FINISHED]:
+                self.builds.remove(old)
+        self._queue.put(build)
+        self.log(build, "queued")
+        return build
+
+    def create_client(self, build):
+        return self.client_factory(build.spec_fn, build.arguments)
+
+    def upload(self, build, client, args):
+        """Send the sources of a build like the android command does: only
+        the files unknown to Hanga with `--delta`, the digests coming from
+        the cache shared by the builds, or while compressing them with
+        `--stream`.
+        """
+        if client.arguments.get("--delta"):
+            manifest, blobs = client.cloud_build_manifest()
+            build.status = "uploading"
+            try:
+                return self.api.submit_delta(args, manifest, blobs)
+            except hanga.HangaException as e:
+                if e.status_code != 404:
+                    raise
+                self.log(build, "delta submission is not supported")
+                build.status = "packing"
+        if client.arguments.get("--stream"):
+            build.status = "uploading"
+            chunks = iter_pack(client.cloud_iter_members(),
+                               **client.cloud_pack_options())
+            return self.api.submit_stream(args, chunks)
+        return super(Agent, self).upload(build, client, args)
+
+    def _work(self):
+        while True:
+            build = self._queue.get()
+            try:
+                if build is None:
+                    return
+                self.submit(build, build.args)
+                self._wakeup.set()
+            finally:
+                self._queue.task_done()
+
+    def _monitor(self):
+        # status of all the builds submitted, in one request
+        while True:
+            with self._builds_lock:
+                waiting = [build for build in self.builds
+                           if build.uuid and not build.finished and
+                           build.status != "downloading"]
+            if not waiting and self._stopping.is_set():
+                return
+            delays = self.update_status(waiting, self._download_pool)
+            self._wakeup.wait(min(delays or [IDLE_DELAY]))
+            self._wakeup.clear()
+
+    def stop(self):
+        """Wait for the builds in progress to finish, and stop the workers.
+        """
+        for _ in range(self.concurrency):
+            self._queue.put(None)
+        self._queue.join()
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+        self._download_pool.close()
+        self._download_pool.join()
+
+
+class AgentHandler(StreamRequestHandler):
+    """Answer one request of a client.
+    """
+
+    def handle(self):
+        try:
+            request = loads(self.rfile.readline().decode("utf-8"))
+            command = request.pop("command")
+            handler = getattr(self, "do_" + command, None)
+            if handler is None:
+                raise ValueError("Unknown command {}".format(command))
+            handler(**request)
+        except (ValueError, KeyError, TypeError) as e:
+            self.send({"result": "error", "details": str(e)})
+        except hanga.HangaException as e:
+            self.send({"result": "error", "details": str(e)})
+        except socket.error:
+            # the client left
+            pass
+
+    @property
+    def agent(self):
+        return self.server.agent
+
+    def send(self, data):
+        self.wfile.write(dumps(data).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+    def do_ping(self):
+        self.send({"result": "ok", "version": __version__, "pid": getpid()})
+
+    def do_submit(self, spec, args=("android", ), wait=True, arguments=None):
+        if not exists(spec):
+            raise ValueError("{} not found".format(spec))
+        arguments = dict((key, value)
+                         for key, value in (arguments or {}).items()
+                         if key in BUILD_ARGUMENTS)
+        build = self.agent.queue(spec, list(args), arguments)
+        self.send({"result": "ok", "id": build.id})
+        state = None
+        while wait and not build.finished:
+            if (build.status, build.progression) != state:
+                state = build.status, build.progression
+                self.send({"event": "build", "id": build.id,
+                           "uuid": build.uuid, "status": build.status,
+                           "progression": build.progression})
+            sleep(WAIT_INTERVAL)
+        summary = build_summary(build)
+        summary["id"] = build.id
+        summary["event"] = "summary"
+        self.send(summary)
+
+    def do_builds(self):
+        with self.agent._builds_lock:
+            builds = list(self.agent.builds)
+        summaries = []
+        for build in builds:
+            summary = build_summary(build)
+            summary["id"] = build.id
+            summaries.append(summary)
+        self.send({"result": "ok", "builds": summaries})
+
+    def do_status(self, uuids):
+        self.send({"result": "ok",
+                   "statuses": self.agent.api.status_many(uuids)})
+
+    def do_download(self, uuid, dest_dir):
+        filename = self.agent.api.download(uuid, dest_dir)
+        self.send({"result": "ok", "filename": filename})
+
+    def do_shutdown(self):
+        self.send({"result": "ok"})
+        # serve_forever can't be stopped from its own thread
+        thread = Thread(target=self.server.shutdown)
+        thread.daemon = True
+        thread.start()
+
+
+class AgentServer(ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_fn, agent=None):
+        if exists(socket_fn):
+            check_stale_socket(socket_fn)
+        elif not exists(dirname(socket_fn)):
+            os.makedirs(dirname(socket_fn))
+        ThreadingUnixStreamServer.__init__(self, socket_fn, AgentHandler)
+        os.chmod(socket_fn, 0o600)
+        self.socket_fn = socket_fn
+        self.agent = agent
+
+    def server_close(self):
+        ThreadingUnixStreamServer.server_close(self)
+        if exists(self.socket_fn):
+            unlink(self.socket_fn)
+
+
+def check_stale_socket(socket_fn):
+    """Remove the socket of an agent no longer running.
+
+    :raise hanga.HangaException: if an agent is running on it.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_fn)
+    except socket.error:
+        unlink(socket_fn)
+        return
+    finally:
+        sock.close()
+    raise hanga.HangaException(
+        "An agent is already running on {}".format(socket_fn))
+
+
+def daemonize(log_fn):
+    """Detach the process from the terminal, its output going to `log_fn`.
+    Only the daemon returns.
+    """
+    if os.fork():
+        # the command returns once the daemon is listening
+        os._exit(0)
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with open(os.devnull, "rb") as fd:
+        os.dup2(fd.fileno(), sys.stdin.fileno())
+    with open(log_fn, "ab") as fd:
+        os.dup2(fd.fileno(), sys.stdout.fileno())
+        os.dup2(fd.fileno(), sys.stderr.fileno())
+
+
+def run_agent(api, client_factory, socket_fn, concurrency=4, detach=False):
+    """Run the agent until it is asked to stop.
+    """
+    server = AgentServer(socket_fn)
+    print("Hanga agent listening on {}".format(socket_fn))
+    if detach:
+        log_fn = socket_fn.rsplit(".", 1)[0] + ".log"
+        print("Running in the background, logging to {}".format(log_fn))
+        # before starting any thread, they don't survive a fork
+        daemonize(log_fn)
+    agent = server.agent = Agent(api, client_factory, concurrency=concurrency)
+    started = time()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    print("Stopping, waiting for the builds in progress")
+    agent.stop()
+    print("Agent stopped after {:.0f}s".format(time() - started))
@@ -0,0 +1,234 @@
+"""
+Batch submission of many Buildozer projects.
+
+Projects are packed and submitted by a pool of workers, and all the builds
+are waited together: each build result is downloaded as soon as it's done.
+"""
+
+from __future__ import print_function
+import hanga
+from hanga.poll import StatusPoller
+from multiprocessing.pool import ThreadPool
+from os import walk, unlink
+from os.path import join, exists, basename, realpath
+from requests.exceptions import RequestException
+from threading import Lock
+from time import sleep, time
+
+# maximum delay between two status checks while projects are still being
+# submitted, so their builds are noticed
+SUBMIT_STATUS_DELAY = 1.
+# errors failing one build of the batch: Hanga, the network, or the files
+BUILD_ERRORS = (hanga.HangaException, RequestException, EnvironmentError)
+
+
+def discover_projects(directories):
+    """Return the list of buildozer.spec found in the directories. A
+    directory without buildozer.spec is searched recursively, hidden
+    directories excepted.
+    """
+    specs = []
+    for directory in directories:
+        spec_fn = join(directory, "buildozer.spec")
+        if exists(spec_fn):
+            specs.append(realpath(spec_fn))
+            continue
+        for root, dirs, files in walk(directory):
+            dirs[:] = sorted(x for x in dirs if not x.startswith("."))
+            if "buildozer.spec" in files:
+                specs.append(realpath(join(root, "buildozer.spec")))
+                # no project inside a project
+                dirs[:] = []
+    return specs
+
+
+class BatchBuild(object):
+    """State of the build of one project in a batch.
+    """
+
+    def __init__(self, spec_fn):
+        super(BatchBuild, self).__init__()
+        self.spec_fn = spec_fn
+        self.client = None
+        self.uuid = None
+        self.status = "pending"
+        self.progression = 0
+        self.details = None
+        self.filename = None
+        self.started = time()
+        self.duration = None
+        self.poller = StatusPoller()
+
+    @property
+    def name(self):
+        return basename(realpath(join(self.spec_fn, "..")))
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error", "downloaded")
+
+    def fail(self, details):
+        self.status = "error"
+        self.details = details
+        self.duration = time() - self.started
+
+
+class BatchRunner(object):
+    """Pack, submit, wait and download the builds of many projects.
+    `client_factory` creates the :class:`HangaClient` of a buildozer.spec.
+    The messages are printed, or written as "batch" events to `events` (a
+    :class:`hanga.progress.JsonProgressLog`).
+    """
+
+    def __init__(self, api, client_factory, concurrency=4, wait=True,
+                 events=None):
+        super(BatchRunner, self).__init__()
+        self.api = api
+        self.client_factory = client_factory
+        self.concurrency = concurrency
+        self.wait = wait
+        self.events = events
+        self.lock = Lock()
+
+    def run(self, spec_fns, args):
+        builds = [BatchBuild(spec_fn) for spec_fn in spec_fns]
+        submit_pool = ThreadPool(self.concurrency)
+        download_pool = ThreadPool(self.concurrency)
+        try:
+            submissions = submit_pool.map_async(
+                lambda build: self.submit(build, args), builds)
+            if not self.wait:
+                submissions.wait()
+                return builds
+
+            while True:
+                submitted = submissions.ready()
+                waiting = [build for build in builds
+                           if build.uuid and not build.finished and
+                           build.status != "downloading"]
+                if submitted and not waiting:
+                    break
+                delays = self.update_status(waiting, download_pool)
+                if not submitted:
+                    delays.append(SUBMIT_STATUS_DELAY)
+                sleep(min(delays or [0]))
+            download_pool.close()
+            download_pool.join()
+        finally:
+            submit_pool.terminate()
+            download_pool.terminate()
+        return builds
+
+    def submit(self, build, args):
+        try:
+            build.status = "packing"
+            client = build.client = self.create_client(build)
+            client.cloud_prepare()
+            result = self.upload(build, client, args)
+            if result.get("result") != "ok":
+                return build.fail(result.get("details"))
+            build.uuid = result["uuid"]
+            build.status = "submitted"
+            self.log(build, "submitted, uuid is {}".format(build.uuid))
+        except BUILD_ERRORS as e:
+            build.fail(str(e) or e.__class__.__name__)
+            self.log(build, "error: {}".format(build.details))
+
+    def upload(self, build, client, args):
+        """Pack the sources of a build and send them, and return the result
+        of the submission.
+        """
+        filename = client.cloud_pack_sources()
+        try:
+            build.status = "uploading"
+            return client._cloud_submit_file(args, filename, None)
+        finally:
+            unlink(filename)
+
+    def create_client(self, build):
+        return self.client_factory(build.spec_fn)
+
+    def update_status(self, builds, download_pool):
+        """Refresh the status of the builds in one request, and download the
+        ones done. Return the delays before the next refresh.
+        """
+        if not builds:
+            return []
+        try:
+            statuses = self.api.status_many(build.uuid for build in builds)
+        except (hanga.HangaException, RequestException) as e:
+            for build in builds:
+                build.fail(str(e))
+            return []
+        return [self.apply_status(build, statuses[build.uuid], download_pool)
+                for build in builds]
+
+    def apply_status(self, build, infos, download_pool):
+        if infos.get("result") != "ok":
+            build.fail(infos.get("details"))
+            return 0
+        status = infos["job_status"]
+        changed = status != build.status
+        build.status = status
+        if changed:
+            self.log(build, status)
+        build.progression = int(infos["job_progression"])
+        if status == "done":
+            build.status = "downloading"
+            download_pool.apply_async(self.download, (build, ))
+        elif status == "error":
+            build.fail("Build failed")
+        return build.poller.next_delay(infos)
+
+    def download(self, build):
+        try:
+            build.filename = self.api.download(
+                build.uuid, build.client.bin_dir)
+            build.status = "downloaded"
+            build.duration = time() - build.started
+            self.log(build, "{} downloaded".format(build.filename))
+        except BUILD_ERRORS as e:
+            build.fail(str(e))
+
+    def log(self, build, message):
+        if self.events:
+            self.events.emit(
+                "batch", project=build.name, spec=build.spec_fn,
+                uuid=build.uuid, status=build.status, message=message)
+            return
+        with self.lock:
+            print("[{}] {}".format(build.name, message))
+
+
+def build_summary(build):
+    """Return the result of a build, as a dictionary.
+    """
+    return {
+        "project": build.name,
+        "spec": build.spec_fn,
+        "uuid": build.uuid,
+        "status": build.status,
+        "filename": build.filename,
+        "details": build.details,
+        "duration": build.duration}
+
+
+def print_summary(builds):
+    """Print a table of the builds, with their status and artifact.
+    """
+    rows = [("Project", "Uuid", "Status", "Artifact / Details", "Time")]
+    for build in builds:
+        duration = ""
+        if build.duration is not None:
+            duration = "{:.0f}s".format(build.duration)
+        rows.append((build.name, build.uuid or "-", build.status,
+                     build.filename or build.details or "", duration))
+    widths = [max(len(row[index]) for row in rows)
+              for index in range(len(rows[0]))]
+    print("")
+    for index, row in enumerate(rows):
+        print("  ".join(value.ljust(width)
+                        for value, width in zip(row, widths)).rstrip())
+        if index == 0:
+            print("  ".join("-" * width for width in widths))
+    print("")
@@ -0,0 +1,931 @@
+"""
+Hanga build commands, made on top of Buildozer: pack the application, submit
+it, and download the build result.
+"""
+
+
+from __future__ import print_function
+import getpass
+import hanga
+import progressbar
+import sys
+import tempfile
+from hashlib import sha256
+from os import chmod, makedirs, stat, unlink, utime
+from os.path import (
+    basename, dirname, exists, expanduser, getsize, join, realpath)
+from shutil import copyfile, rmtree
+from buildozer import Buildozer
+from hanga.cache import (
+    ArtifactCache, CACHE_MAX_SIZE, DigestCache, PackCache, cache_key)
+from hanga.pack import (
+    CompressionPolicy, format_stats, iter_pack, pack, reproducible_date_time)
+from hanga.progress import ProgressBus, ProgressMetrics
+from hanga.scan import SourceScanner
+from hanga.scripts.common import fail
+from hanga.trace import Tracer
+try:
+    from configparser import SafeConfigParser
+except ImportError:
+    from ConfigParser import SafeConfigParser
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+IS_PY3 = sys.version_info[0] >= 3
+# delay before submitting the sources again after a failed submission in
+# watch mode, in seconds
+WATCH_RETRY_DELAY = 30.
+
+
+def canonical_spec(config):
+    """Serialize a configuration canonically: the sections and their
+    options sorted, the default values only in the [DEFAULT] section.
+    """
+    defaults = config.defaults()
+    sections = [("DEFAULT", defaults)]
+    for section in sorted(config.sections()):
+        sections.append((section, dict(
+            (key, value) for key, value in config.items(section, raw=True)
+            if key not in defaults or defaults[key] != value)))
+    lines = []
+    for section, options in sections:
+        if section == "DEFAULT" and not options:
+            continue
+        lines.append("[{}]".format(section))
+        for key, value in sorted(options.items()):
+            if value is None:
+                lines.append(key)
+            else:
+                value = "\n\t".join(
+                    x.strip() for x in value.strip().splitlines())
+                lines.append("{} = {}".format(key, value))
+        lines.append("")
+    return "\n".join(lines)
+
+
+class Text(progressbar.Widget):
+    __slots__ = ("text_callback", )
+
+    def __init__(self, callback):
+        super(Text, self).__init__()
+        self.text_callback = callback
+
+    def update(self, pbar):
+        return self.text_callback()
+
+
+class ProgressBarView(object):
+    """Draw the events of a :class:`hanga.progress.ProgressBus` on the
+    terminal, one progress bar per phase.
+    """
+
+    def __init__(self):
+        super(ProgressBarView, self).__init__()
+        self._pbar = None
+        self._phase = None
+        self._status = None
+
+    def __call__(self, event):
+        if event.phase != self._phase:
+            self.finish()
+            self._phase = event.phase
+            self._pbar = progressbar.ProgressBar(
+                widgets=self._widgets(event),
+                maxval=event.total or progressbar.UnknownLength)
+            self._pbar.start()
+        self._status = event.status
+        self._pbar.update(event.current)
+        if event.finished:
+            self.finish()
+
+    def finish(self):
+        if self._pbar:
+            self._pbar.finish()
+        self._pbar = self._phase = None
+
+    def _widgets(self, event):
+        if event.phase == "build":
+            return [
+                Text(self._get_status),
+                " ", progressbar.Bar(left="[", right="]"), " ",
+                progressbar.Timer()]
+        label = "Upload " if event.phase == "upload" else "Downloading "
+        if event.total is None:
+            # streamed, the final size is unknown
+            return [label, progressbar.AnimatedMarker(),
+                    " ", progressbar.FileTransferSpeed()]
+        return [label, progressbar.Bar(left="[", right="]"),
+                " ", progressbar.FileTransferSpeed()]
+
+    def _get_status(self):
+        return (self._status or "waiting").capitalize()
+
+
+class HangaClient(Buildozer):
+    # cache key of the application being built
+    _cache_key = None
+    # application sources selected, see cloud_scan_sources
+    _sources = ()
+    # compressed members of the previous builds, see cloud_pack_options
+    _pack_cache = None
+    # sha256 of the sources, see cloud_build_manifest
+    _digest_cache = None
+    # False once the server refused a delta submission in watch mode
+    _delta_supported = True
+    # JsonProgressLog of the --json mode
+    events = None
+
+    def run_command(self, arguments, api, events=None):
+        """Run a build command (android, importkey or batch) with the
+        :class:`hanga.HangaAPI` `api`, already configured. In --json mode,
+        the events are written to `events`, a
+        :class:`hanga.progress.JsonProgressLog`.
+        """
+        self.arguments = arguments
+        if "--profile" in arguments:
+            self.config_profile = arguments["--profile"]
+        if "--verbose" in arguments:
+            self.log_level = 2
+        self._hangaapi = api
+        self.events = events
+
+        # progress of the transfers and of the build
+        self.progress = ProgressBus()
+        self._progress_bar = ProgressBarView()
+        self._progress_metrics = ProgressMetrics()
+        self.progress.subscribe(events or self._progress_bar)
+        self.progress.subscribe(self._progress_metrics)
+        self.tracer = Tracer()
+        self.progress.subscribe(self.tracer)
+
+        try:
+            if arguments["android"]:
+                self._run_android_build(arguments)
+            elif arguments["importkey"]:
+                self._run_importkey(arguments)
+            elif arguments["batch"]:
+                self._run_batch(arguments)
+            elif arguments["watch"]:
+                self._run_watch(arguments)
+            elif arguments["agent"]:
+                self._run_agent(arguments)
+        finally:
+            self.cloud_report_trace()
+
+    def _run_android_build(self, arguments):
+        try:
+            self._android_build(arguments)
+        except hanga.HangaException as e:
+            fail(self.events, e)
+
+    def _android_build(self, arguments):
+        args = ["android"]
+        if arguments.get("--resume"):
+            # only the same archive can be resumed
+            if not arguments.get("--reproducible"):
+                self.error("--resume needs --reproducible")
+                sys.exit(1)
+            if arguments.get("--delta") or arguments.get("--stream"):
+                self.error("--resume can't be used with --delta or --stream")
+                sys.exit(1)
+
+        # pack the source code and submit it
+        with self.tracer.span("prepare"):
+            self.cloud_prepare()
+
+        use_cache = not arguments.get("--no-cache")
+        if arguments.get("--delta") or use_cache:
+            self.info("Compute the application manifest")
+            with self.tracer.span("manifest") as span:
+                manifest, blobs = self.cloud_build_manifest()
+                span.attrs["bytes"] = sum(x["size"] for x in manifest)
+        if use_cache:
+            self._cache_key = cache_key(manifest, args)
+            with self.tracer.span("cache"):
+                cached = self.cloud_fetch_cached()
+            if cached:
+                self.info("Done !")
+                return
+
+        if arguments.get("--delta"):
+            self.info("Submit the application changes to build")
+            try:
+                uuid = self.cloud_upload(args, manifest=manifest, blobs=blobs)
+            except hanga.HangaException as e:
+                if e.status_code != 404:
+                    raise
+                self.info("Delta submission is not supported by the server")
+            else:
+                self.cloud_wait(uuid)
+                self.info("Done !")
+                return
+
+        if arguments.get("--stream"):
+            self.info("Compress and submit the application to build")
+            stats = {}
+            chunks = iter_pack(self.cloud_iter_members(), stats=stats,
+                               **self.cloud_pack_options())
+            self.cloud_submit(args, chunks=chunks)
+            self.cloud_report_compression(stats)
+            self.info("Done !")
+            return
+
+        self.info("Compress the application")
+        filename = None
+        try:
+            with self.tracer.span("pack") as span:
+                filename = self.cloud_pack_sources()
+                span.attrs["bytes"] = getsize(filename)
+            self.info("Submit the application to build")
+            self.cloud_submit(args, filename)
+        finally:
+            if filename:
+                unlink(filename)
+        self.info("Done !")
+
+    def _run_watch(self, arguments):
+        from hanga.poll import StatusPoller
+        from hanga.watch import DEBOUNCE, create_watcher, wait_changes
+        from requests.exceptions import RequestException
+
+        # errors of a build not stopping the watch
+        errors = (hanga.HangaException, RequestException)
+
+        args = ["android"]
+        debounce = float(arguments.get("--debounce") or DEBOUNCE)
+        self.cloud_prepare()
+        source_dir = realpath(expanduser(
+            self.config.getdefault("app", "source.dir", ".")))
+        watcher = create_watcher(sorted(set([source_dir, self.root_dir])),
+                                 exclude=self.cloud_watch_excluded())
+        self.debug("Watch {} with {}".format(source_dir, watcher.name))
+
+        # sources of the last build submitted
+        snapshot = None
+        uuid = None
+        poller = None
+        changes = True
+        retry = False
+        try:
+            while True:
+                if changes or retry:
+                    retry = False
+                    current = self.cloud_sources_snapshot()
+                    if current != snapshot:
+                        if uuid:
+                            self.cloud_supersede(uuid)
+                        uuid = None
+                        try:
+                            uuid = self.cloud_watch_submit(args)
+                        except errors as e:
+                            self.cloud_watch_failed("Submission", e)
+                            retry = True
+                        if uuid:
+                            snapshot = current
+                        poller = StatusPoller()
+
+                timeout = WATCH_RETRY_DELAY if retry else None
+                if uuid:
+                    try:
+                        infos = self._hangaapi.status(uuid)
+                    except (hanga.HangaException, RequestException) as e:
+                        # keep watching, the status is asked again later
+                        self.error("Unable to get the build status: "
+                                   "{}".format(e))
+                        infos = {"result": "ok"}
+                    else:
+                        self.progress.status(infos)
+                    if infos.get("result") != "ok" or \
+                            infos.get("job_status") in ("done", "error"):
+                        self._progress_bar.finish()
+                        if infos.get("job_status") == "done":
+                            try:
+                                self.api_download(uuid)
+                            except errors as e:
+                                self.cloud_watch_failed("Download", e)
+                        else:
+                            self.error("Build {} failed: {}".format(
+                                uuid, infos.get("details", "unknown")))
+                        uuid = None
+                    else:
+                        timeout = poller.next_delay(infos)
+                if uuid is None and timeout is None:
+                    self.info("Waiting for changes in {}".format(source_dir))
+                changes = wait_changes(watcher, timeout, debounce)
+                if changes:
+                    self.debug("{} paths changed".format(len(changes)))
+                    self.cloud_select_sources()
+        finally:
+            watcher.close()
+
+    def cloud_watch_excluded(self):
+        """Return the directories written by the builds, not watched: the
+        bin directory, where the results are downloaded, and the buildozer
+        directory.
+        """
+        return [realpath(self.bin_dir), realpath(self.buildozer_dir)]
+
+    def cloud_sources_snapshot(self):
+        """Return the state of the sources selected and of the
+        buildozer.spec, to know if a new build is needed. The files of the
+        directories not watched are ignored.
+        """
+        source_dir = realpath(expanduser(
+            self.config.getdefault("app", "source.dir", ".")))
+        excluded = tuple(join(x, "") for x in self.cloud_watch_excluded())
+        # the sources may be copies, see cloud_copy_sources
+        snapshot = [(rel_fn, st.st_size, st.st_mtime)
+                    for full_fn, rel_fn, st in self._sources
+                    if not join(source_dir, *rel_fn.split("/")).startswith(
+                        excluded)]
+        st = stat(self.specfilename)
+        snapshot.append((None, st.st_size, st.st_mtime))
+        return sorted(snapshot, key=lambda x: x[0] or "")
+
+    def cloud_watch_submit(self, args):
+        """Submit the application in watch mode: only the files unknown to
+        Hanga are sent, else the zip, compressing only the files changed.
+
+        :return: the uuid of the job, or None.
+        """
+        manifest, blobs = self.cloud_build_manifest()
+        if self._delta_supported:
+            try:
+                return self.cloud_upload(args, manifest=manifest, blobs=blobs)
+            except hanga.HangaException as e:
+                if e.status_code != 404:
+                    raise
+                self.info("Delta submission is not supported by the server")
+                self._delta_supported = False
+        filename = self.cloud_pack_sources()
+        try:
+            return self.cloud_upload(args, filename)
+        finally:
+            unlink(filename)
+
+    def cloud_watch_failed(self, action, e):
+        """Report a failure of the watch mode, which keeps watching: a
+        failed submission is retried.
+        """
+        self.error("{} failed: {}".format(action, e))
+
+    def cloud_supersede(self, uuid):
+        """Cancel the build `uuid` in progress, replaced by a newer one.
+        """
+        self.info("Sources changed, build {} superseded".format(uuid))
+        try:
+            cancelled = self._hangaapi.cancel(uuid)
+        except hanga.HangaException as e:
+            self.debug("Unable to cancel the build: {}".format(e))
+            cancelled = False
+        if not cancelled:
+            self.debug("The build {} keeps running".format(uuid))
+        # end the progress of the build
+        self.progress.status({"result": "error", "job_status": "superseded"})
+        self._progress_bar.finish()
+
+    def error(self, msg):
+        if self.events:
+            self.events.emit("error", message=msg)
+        super(HangaClient, self).error(msg)
+
+    def cloud_prepare(self):
+        """Prepare the application to be packed: ensure the build layout,
+        and select the application sources. They are packed directly from
+        the source.dir, unless `--copy-sources` is used.
+        """
+        self._merge_config_profile()
+
+        # fake the target
+        self.targetname = "hanga"
+        self.check_build_layout()
+
+        # the source.dir is relative to the buildozer.spec, not to the
+        # current directory
+        source_dir = self.config.getdefault("app", "source.dir", ".")
+        self.config.set("app", "source.dir", join(self.root_dir, source_dir))
+
+        self.info("Prepare the source code to pack")
+        self.cloud_select_sources()
+
+    def cloud_select_sources(self):
+        """Select the application sources to pack, and copy them with
+        `--copy-sources`.
+        """
+        self._sources = self.cloud_scan_sources()
+        if self.arguments.get("--copy-sources"):
+            self.cloud_copy_sources()
+
+    def cloud_scan_sources(self):
+        """Select the application sources from the buildozer.spec rules.
+        Hidden and excluded directories are not walked.
+
+        :return: a list of (filename, relative name, stat result).
+        """
+        source_dir = realpath(expanduser(
+            self.config.getdefault("app", "source.dir", ".")))
+        scanner = SourceScanner.from_config(self.config, source_dir)
+        self.debug("Scan application source from {}".format(source_dir))
+        sources = list(scanner.scan())
+        for reason, skipped in sorted(scanner.skipped.items()):
+            self.debug("Skipped {} by {}".format(skipped, reason))
+        self.info("{} files selected, {} files or directories skipped".format(
+            len(sources), sum(scanner.skipped.values())))
+        return sources
+
+    def cloud_copy_sources(self):
+        """Copy the application sources selected into the app_dir, and pack
+        them from there.
+        """
+        self.debug("Copy application source to {}".format(self.app_dir))
+        if exists(self.app_dir):
+            rmtree(self.app_dir)
+        sources = []
+        for full_fn, rel_fn, st in self._sources:
+            dest_fn = join(self.app_dir, *rel_fn.split("/"))
+            dest_dir = dirname(dest_fn)
+            if not exists(dest_dir):
+                makedirs(dest_dir)
+            copyfile(full_fn, dest_fn)
+            # keep the date and mode in the archive
+            chmod(dest_fn, st.st_mode & 0o7777)
+            utime(dest_fn, (st.st_atime, st.st_mtime))
+            sources.append((dest_fn, rel_fn, st))
+        self._sources = sources
+
+    def cloud_fetch_cached(self):
+        """Get the build result of the application from the local cache, or
+        from a build already done by Hanga.
+
+        :return: True if the build result is now in the bin directory.
+        """
+        filename = self.artifact_cache.get(self._cache_key, self.bin_dir)
+        if filename:
+            self.info("{} is available in the bin directory (cached)".format(
+                filename))
+            if self.events:
+                self.events.emit("artifact", filename=join(
+                    self.bin_dir, filename), cached=True)
+            return True
+
+        try:
+            uuid = self._hangaapi.lookup_artifact(self._cache_key)
+        except hanga.HangaException:
+            uuid = None
+        if not uuid:
+            return False
+        self.info("Application already built, uuid is {}".format(uuid))
+        self.api_download(uuid)
+        return True
+
+    def cloud_cache_store(self, uuid, filename):
+        """Store a build result in the local cache, and share it with Hanga.
+        """
+        self.artifact_cache.put(self._cache_key, join(self.bin_dir, filename))
+        try:
+            self._hangaapi.register_artifact(self._cache_key, uuid)
+        except hanga.HangaException as e:
+            self.debug("Unable to share the build result: {}".format(e))
+
+    @property
+    def artifact_cache(self):
+        c = self._hangaapi.config
+        max_size = CACHE_MAX_SIZE
+        if c.has_option("cache", "max_size"):
+            # in megabytes
+            max_size = int(c.get("cache", "max_size")) * 1024 * 1024
+        return ArtifactCache(max_size=max_size)
+
+    def cloud_pack_sources(self):
+        """Pack all the application sources and dependencies into a single zip.
+        This zip file will be sent to the cloud builder. The files are
+        compressed in parallel, using `--workers` threads.
+
+        :return: fd to the temporary file. It should be closed when you're
+        finished to use it.
+        """
+
+        stats = {}
+        with tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as fd:
+            digest = pack(self.cloud_iter_members(), fd, stats=stats,
+                          **self.cloud_pack_options())
+        self.cloud_report_compression(stats)
+        log = self.info if self.arguments.get("--reproducible") else \
+            self.debug
+        log("Archive sha256 {}".format(digest))
+        if self.events:
+            self.events.emit("archive", sha256=digest,
+                             size=getsize(fd.name))
+        return fd.name
+
+    def cloud_pack_options(self):
+        """Return the options of :func:`hanga.pack.pack`: the number of
+        `--workers`, the compression policy, read from the [hanga]
+        section of the buildozer.spec, the cache of the compressed
+        members unless `--no-pack-cache` is used, and `--reproducible`.
+        """
+        workers = self.arguments.get("--workers")
+        reproducible = bool(self.arguments.get("--reproducible"))
+        try:
+            policy = CompressionPolicy.from_config(self.config)
+        except ValueError as e:
+            self.error("Invalid compression configuration: {}".format(e))
+            sys.exit(1)
+        if reproducible:
+            try:
+                reproducible_date_time()
+            except ValueError as e:
+                self.error(str(e))
+                sys.exit(1)
+        cache = None
+        if not self.arguments.get("--no-pack-cache"):
+            if self._pack_cache is None:
+                self._pack_cache = PackCache()
+            cache = self._pack_cache
+        return {"workers": int(workers) if workers else None,
+                "policy": policy,
+                "cache": cache,
+                "reproducible": reproducible}
+
+    def cloud_report_compression(self, stats):
+        """Log the compression ratio, per file type in verbose mode.
+        """
+        if not stats:
+            return
+        lines = format_stats(stats)
+        for line in lines[:-1]:
+            self.debug(line)
+        cache = self._pack_cache
+        if cache is not None and cache.hits + cache.misses:
+            self.debug("{} files reused from the pack cache, {} "
+                       "compressed".format(cache.hits, cache.misses))
+        self.info("Compressed: {}".format(" ".join(lines[-1].split()[1:])))
+
+    def cloud_iter_members(self):
+        """Iterate over the members of the zip to send, as expected by
+        :func:`hanga.pack.pack`.
+        """
+        # add the buildozer definition
+        yield self.cloud_build_spec(), "buildozer.spec"
+
+        # add the application
+        for full_fn, arc_fn in self.cloud_iter_sources():
+            yield full_fn, arc_fn
+
+    def cloud_build_spec(self):
+        """Return the content of the buildozer.spec to send along the
+        application, adjusted to the layout of the archive. With
+        `--reproducible`, it is serialized canonically.
+        """
+        self.debug("Create custom buildozer.spec")
+        config = SafeConfigParser()
+        config.read(self.specfilename)
+        config.set("app", "source.dir", "app")
+
+        if self.arguments.get("--reproducible"):
+            spec = canonical_spec(config)
+        else:
+            spec_fd = StringIO()
+            config.write(spec_fd)
+            spec = spec_fd.getvalue()
+        if IS_PY3:
+            spec = spec.encode("utf-8")
+        return spec
+
+    def cloud_iter_sources(self):
+        """Iterate over all the files of the application to send, as a tuple
+        (filename, name in the archive).
+        """
+        for full_fn, rel_fn, st in self._sources:
+            yield full_fn, "app/" + rel_fn
+
+    def cloud_build_manifest(self):
+        """Build the manifest of the application for a delta submission.
+
+        :return: a tuple (manifest, blobs), as expected by
+        :meth:`hanga.HangaAPI.submit_delta`.
+        """
+        manifest = []
+        blobs = {}
+
+        spec = self.cloud_build_spec()
+        digest = sha256(spec).hexdigest()
+        manifest.append({
+            "path": "buildozer.spec", "sha256": digest, "size": len(spec)})
+        blobs[digest] = spec
+
+        # the digests of the files unchanged since the previous builds are
+        # reused, even from another command
+        if self._digest_cache is None:
+            self._digest_cache = DigestCache()
+        for full_fn, arc_fn in self.cloud_iter_sources():
+            st = stat(full_fn)
+            digest = self._digest_cache.digest(full_fn, st)
+            manifest.append({
+                "path": arc_fn, "sha256": digest, "size": st.st_size})
+            blobs[digest] = full_fn
+        self._digest_cache.save()
+
+        return manifest, blobs
+
+    def cloud_submit(self, args, filename=None, manifest=None, blobs=None,
+                     chunks=None):
+        """Submit a job to the cloud builder. It consists of sending the
+        application zip file and the argument used in the command line.
+        And then, wait for the build to be done :)
+
+        If a manifest is passed instead of a filename, only the blobs missing
+        on the server are sent. If the server doesn't support it, the
+        `HangaException` is raised with the status code 404, so the caller
+        can send the whole zip. If chunks are passed, the zip is streamed
+        while being produced.
+
+        :raise hanga.HangaException: if the submission or the download
+                                     failed.
+        """
+        uuid = self.cloud_upload(args, filename, manifest, blobs, chunks)
+        self.cloud_wait(uuid)
+
+    def cloud_wait(self, uuid):
+        """Wait for the build `uuid` submitted, unless `--nowait` is used,
+        and download its result.
+
+        :raise hanga.HangaException: if the download failed.
+        """
+        if uuid is None or self.arguments.get("--nowait"):
+            return
+
+        # Part 2, wait.
+        print("Or you can wait for the build to finish.")
+        print("It will automatically download the package when done.")
+        print("")
+
+        status = ""
+        try:
+            for infos in self._hangaapi.iter_status(uuid):
+                self.progress.status(infos)
+                if infos.get("result") != "ok":
+                    return
+                status = infos["job_status"]
+        finally:
+            self._progress_bar.finish()
+
+        # if the build is broken, don't do anything
+        if status != "done":
+            return
+
+        # Part 3: download
+        self.api_download(uuid)
+
+    def cloud_upload(self, args, filename=None, manifest=None, blobs=None,
+                     chunks=None):
+        """Send the application to the cloud builder, as described in
+        :meth:`cloud_submit`.
+
+        :return: the uuid of the job, or None if the submission was refused.
+        :raise hanga.HangaException: if the submission failed.
+        """
+        self.info("Submitting {}".format(self.config.get("app", "title")))
+        result = None
+
+        # Part 1 - submit
+        upload = self.progress.phase("upload")
+        try:
+            if manifest is not None:
+                result = self._hangaapi.submit_delta(
+                    args, manifest, blobs, upload)
+            elif chunks is not None:
+                result = self._hangaapi.submit_stream(args, chunks, upload)
+            else:
+                result = self._cloud_submit_file(args, filename, upload)
+        finally:
+            upload.finish()
+            self._progress_bar.finish()
+        self.cloud_report_transfer("upload")
+
+        package = "{}.{}".format(
+            self.config.get("app", "package.domain"),
+            self.config.get("app", "package.name"))
+
+        if result.get("result") == "ok":
+            uuid = result.get("uuid")
+            if self.events:
+                self.events.context["uuid"] = uuid
+                self.events.emit("submitted", package=package)
+            print("")
+            print("Build submitted, uuid is {}".format(uuid))
+            print("You can check the build status at:")
+            print("")
+            print("    https://hanga.io/app/{}".format(package))
+            print("")
+        else:
+            details = result.get("details")
+            self.error("Submission error: {}".format(details))
+            return None
+        return uuid
+
+    def cloud_report_trace(self):
+        """Log the timings of the phases in verbose mode, and write them to
+        the `--trace` file.
+        """
+        if not self.tracer.spans:
+            return
+        if self.events:
+            self.events.emit("timings", spans=[{
+                "name": span.name,
+                "duration": round(span.duration, 6),
+                "bytes": span.attrs.get("bytes")} for span in sorted(
+                    self.tracer.spans, key=lambda x: x.started)])
+        trace_fn = self.arguments.get("--trace")
+        for line in self.tracer.summary():
+            if trace_fn:
+                self.info(line)
+            else:
+                self.debug(line)
+        if trace_fn:
+            self.tracer.write(trace_fn)
+            self.info("Trace written to {}".format(trace_fn))
+
+    def cloud_report_transfer(self, phase):
+        """Log the size and rate of the last transfer of a phase.
+        """
+        event = self._progress_metrics.phases.get(phase)
+        if event is None or not event.finished:
+            return
+        self.debug("{} {} bytes in {:.1f}s ({:.0f} KB/s)".format(
+            phase.capitalize(), event.current, event.elapsed,
+            event.rate / 1024.))
+
+    def _cloud_submit_file(self, args, filename, callback):
+        # resumable upload by parts, if the server supports it
+        parallel = self.arguments.get("--parallel")
+        upload_id = self.arguments.get("--resume")
+        try:
+            return self._hangaapi.submit_chunked(
+                args, filename, callback,
+                workers=int(parallel) if parallel else 1,
+                upload_id=upload_id)
+        except hanga.HangaException as e:
+            if getattr(e, "upload_id", None):
+                # the archive packed again is the same only if reproducible
+                if self.arguments.get("--reproducible"):
+                    raise hanga.HangaException(
+                        "{}, resume it with --reproducible --resume "
+                        "{}".format(e, e.upload_id))
+                raise
+            if e.status_code != 404 or upload_id:
+                raise
+        self.debug("Chunked upload is not supported by the server")
+        return self._hangaapi.submit(args, filename, callback)
+
+    def api_download(self, uuid):
+        """Download the result of the build `uuid` into the bin directory.
+
+        :raise hanga.HangaException: if the download failed.
+        """
+        self.info("Downloading the build result")
+
+        options = {}
+        if self.arguments.get("--parallel"):
+            options["workers"] = int(self.arguments["--parallel"])
+        download = self.progress.phase("download")
+        try:
+            filename = self._hangaapi.download(
+                uuid, self.bin_dir, callback=download, **options)
+        finally:
+            download.finish()
+            self._progress_bar.finish()
+        self.cloud_report_transfer("download")
+
+        self.info("{} is available in the bin directory".format(filename))
+        if self.events:
+            self.events.emit("artifact", uuid=uuid, filename=join(
+                self.bin_dir, filename), cached=False)
+        if self._cache_key:
+            self.cloud_cache_store(uuid, filename)
+
+    def _run_batch(self, arguments):
+        from hanga.scripts.batch import (
+            BatchRunner, build_summary, discover_projects, print_summary)
+
+        spec_fns = discover_projects(arguments["<dir>"])
+        if not spec_fns:
+            self.error("No buildozer.spec found")
+            sys.exit(1)
+        print("Building {} projects".format(len(spec_fns)))
+
+        def client_factory(spec_fn):
+            client = self.__class__(filename=spec_fn)
+            client.arguments = arguments
+            client.config_profile = self.config_profile
+            client.log_level = self.log_level
+            client._hangaapi = self._hangaapi
+            return client
+
+        runner = BatchRunner(
+            self._hangaapi, client_factory,
+            concurrency=int(arguments["--concurrency"]),
+            wait=not arguments.get("--nowait"), events=self.events)
+        builds = runner.run(spec_fns, ["android"])
+        if self.events:
+            self.events.emit("summary", builds=[
+                build_summary(build) for build in builds])
+        else:
+            print_summary(builds)
+        if any(build.status == "error" for build in builds):
+            sys.exit(1)
+
+    def _run_agent(self, arguments):
+        from hanga.agent import agent_socket_fn
+        from hanga.scripts.agent import run_agent
+
+        # shared by all the builds
+        pack_cache = PackCache()
+        digest_cache = DigestCache()
+
+        def client_factory(spec_fn, options):
+            client = self.__class__(filename=spec_fn)
+            client.arguments = dict(arguments)
+            client.arguments.update(options)
+            client.config_profile = options.get("--profile") or \
+                self.config_profile
+            client.log_level = self.log_level
+            client._hangaapi = self._hangaapi
+            client._pack_cache = pack_cache
+            client._digest_cache = digest_cache
+            return client
+
+        try:
+            run_agent(self._hangaapi, client_factory,
+                      arguments.get("--socket") or agent_socket_fn(),
+                      concurrency=int(arguments["--concurrency"]),
+                      detach=arguments.get("--detach"))
+        except hanga.HangaException as e:
+            fail(self.events, e)
+
+    def _run_importkey(self, arguments):
+        filename = arguments["<keystore>"]
+        print("Importing <{}> to Hanga.io".format(basename(filename)))
+        print("")
+        if not exists(filename):
+            self.error("Unable to find the file {}".format(filename))
+            sys.exit(1)
+
+        keystore_password = ""
+        alias = ""
+        alias_password = ""
+        title = ""
+
+        while not keystore_password:
+            keystore_password = getpass.getpass("Keystore password: ")
+            if keystore_password:
+                break
+            self.error("Error, empty password")
+
+        while not alias:
+            print("Key/alias name: ", end="")
+            alias = raw_input()
+            if alias:
+                break
+            self.error("Error, empty key/alias.")
+
+        alias_password = getpass.getpass(
+            "Key password (let empty to use the keystore password): ")
+        if not alias_password:
+            alias_password = keystore_password
+
+        print("Give a name to Hanga for identify this key: ", end="")
+        while not title:
+            title = raw_input()
+            if title:
+                break
+            self.error("No name, please enter one")
+            print("Name this keystore: ", end="")
+
+        print("")
+        print("Thanks you, we are adding your key...")
+
+        try:
+            ret = self._hangaapi.importkey(
+                "android",
+                title,
+                keystore=filename,
+                keystore_password=keystore_password,
+                alias=alias,
+                alias_password=alias_password)
+        except hanga.HangaException as e:
+            fail(self.events, e)
+
+        if self.events:
+            if ret["result"] == "ok":
+                self.events.emit("key_added", title=title)
+            else:
+                self.events.emit("error", message=ret["details"])
+        if ret["result"] == "ok":
+            print("... Key added!")
+        else:
+            print("... Error: {}".format(ret["details"]))
+
+
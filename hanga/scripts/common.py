@@ -0,0 +1,42 @@
+"""
+Helpers shared by the commands: the reporting of the errors, in --json mode
+too.
+"""
+
+from __future__ import print_function
+import sys
+
+
+def error(message):
+    print(message, file=sys.stderr)
+
+
+def fail(events, message):
+    """Print the error, and exit.
+    """
+    if events:
+        events.emit("error", message=str(message))
+    print("")
+    print("Error: {}".format(message))
+    print("")
+    sys.exit(1)
+
+
+def check_configuration(api, events):
+    """Exit with the instructions to setup the API key if it's missing.
+    """
+    from hanga.api import HangaException
+    try:
+        api.ensure_configuration()
+    except HangaException as e:
+        if events:
+            events.emit("error", message=str(e))
+        print("")
+        print("Error: {}".format(e))
+        print("")
+        print("To setup your API key:")
+        print("")
+        print("1. Get the API key at https://hanga.io/settings")
+        print("2. Run: hanga set apikey YOUR_API_KEY")
+        print("")
+        sys.exit(1)
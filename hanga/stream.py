@@ -0,0 +1,55 @@
+"""
+Parsers of the status streams pushed by Hanga.
+
+A stream is either Server-Sent Events (text/event-stream), or lines of JSON
+(application/x-ndjson). Both are parsed into (event, data, id) tuples, the
+data being the JSON text of the event.
+"""
+
+SSE_CONTENT_TYPE = "text/event-stream"
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+
+def iter_server_events(lines):
+    """Parse Server-Sent Events from an iterable of lines, without their
+    line ending. The comments (like the keep-alive ones) are skipped.
+    """
+    event = None
+    data = []
+    event_id = None
+    for line in lines:
+        if not line:
+            # a blank line dispatches the event
+            if data:
+                yield event or "message", "\n".join(data), event_id
+            event = None
+            data = []
+            continue
+        if line.startswith(":"):
+            continue
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "event":
+            event = value
+        elif field == "data":
+            data.append(value)
+        elif field == "id":
+            event_id = value
+
+
+def iter_json_lines(lines):
+    """Parse a stream of JSON lines, each line being a "status" event. The
+    empty lines (keep-alive) are skipped.
+    """
+    for line in lines:
+        if line.strip():
+            yield "status", line, None
+
+
+def iter_stream_events(content_type, lines):
+    """Parse the events of a stream from its content type.
+    """
+    if (content_type or "").startswith(NDJSON_CONTENT_TYPE):
+        return iter_json_lines(lines)
+    return iter_server_events(lines)
@@ -0,0 +1,185 @@
+"""
+Timings of the phases of a build.
+
+A :class:`Tracer` records a :class:`Span` per phase: the ones of the client
+(preparing, packing...) with :meth:`Tracer.span`, and the transfers and the
+build statuses from the events of a :class:`hanga.progress.ProgressBus` it
+is subscribed to::
+
+    tracer = Tracer()
+    bus.subscribe(tracer)
+    with tracer.span("pack") as span:
+        span.attrs["bytes"] = pack_sources()
+    tracer.write("trace.json")
+
+The spans of the build statuses start when the client notices them, so they
+are as precise as the status polling.
+"""
+
+from contextlib import contextmanager
+from json import dump
+from os import getpid
+from threading import Lock
+from time import time
+
+# thread of each category of spans, in the Chrome traces
+CATEGORIES = ("client", "transfer", "build")
+
+
+class Span(object):
+    """A phase, from `started` to `ended` (timestamps). `attrs` can contain
+    the number of `bytes` processed.
+    """
+
+    __slots__ = ("name", "category", "started", "ended", "attrs")
+
+    def __init__(self, name, category, started, ended=None, attrs=None):
+        super(Span, self).__init__()
+        self.name = name
+        self.category = category
+        self.started = started
+        self.ended = ended
+        self.attrs = attrs or {}
+
+    @property
+    def duration(self):
+        return (self.ended or time()) - self.started
+
+    @property
+    def throughput(self):
+        """Bytes processed per second, or None.
+        """
+        nbytes = self.attrs.get("bytes")
+        if nbytes is None or not self.duration:
+            return None
+        return nbytes / self.duration
+
+
+class Tracer(object):
+    """Record the spans of the phases of a build.
+    """
+
+    def __init__(self):
+        super(Tracer, self).__init__()
+        self.spans = []
+        self._lock = Lock()
+        self._status = None
+
+    @contextmanager
+    def span(self, name, category="client", **attrs):
+        """Context manager recording a span around its block.
+        """
+        span = Span(name, category, time(), attrs=attrs)
+        try:
+            yield span
+        finally:
+            span.ended = time()
+            self._add(span)
+
+    def add(self, name, started, ended, category="client", **attrs):
+        self._add(Span(name, category, started, ended, attrs))
+
+    def _add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def __call__(self, event):
+        # subscriber of a ProgressBus
+        now = time()
+        if event.phase != "build":
+            if event.finished:
+                self.add(event.phase, now - event.elapsed, now,
+                         category="transfer", bytes=event.current)
+            return
+        if self._status is not None and (
+                event.status != self._status.name or event.finished):
+            self._status.ended = now
+            self._add(self._status)
+            self._status = None
+        if self._status is None and not event.finished:
+            self._status = Span(event.status, "build", now)
+
+    def summary(self):
+        """Return the lines of a table of the spans.
+        """
+        if not self.spans:
+            return []
+        spans = sorted(self.spans, key=lambda x: x.started)
+        lines = ["{:<12} {:>9} {:>12} {:>12}".format(
+            "Phase", "Duration", "Bytes", "Throughput")]
+        for span in spans:
+            nbytes = span.attrs.get("bytes")
+            throughput = span.throughput
+            lines.append("{:<12} {:>8.2f}s {:>12} {:>12}".format(
+                span.name, span.duration,
+                "" if nbytes is None else nbytes,
+                "" if throughput is None else "{:.0f} KB/s".format(
+                    throughput / 1024.)).rstrip())
+        total = max(x.ended for x in spans) - spans[0].started
+        lines.append("{:<12} {:>8.2f}s".format("total", total))
+        return lines
+
+    def write(self, filename):
+        """Write the spans into filename: a Chrome trace if it ends with
+        .json, OpenMetrics text otherwise.
+        """
+        with open(filename, "w") as fd:
+            if filename.endswith(".json"):
+                self.write_chrome_trace(fd)
+            else:
+                self.write_openmetrics(fd)
+
+    def write_chrome_trace(self, fileobj):
+        """Write the spans in the Chrome trace event format, for
+        chrome://tracing or https://ui.perfetto.dev/.
+        """
+        if not self.spans:
+            origin = time()
+        else:
+            origin = min(x.started for x in self.spans)
+        pid = getpid()
+        events = [{
+            "name": "thread_name", "ph": "M", "pid": pid,
+            "tid": index, "args": {"name": category}}
+            for index, category in enumerate(CATEGORIES)]
+        for span in self.spans:
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "pid": pid,
+                "tid": CATEGORIES.index(span.category),
+                "ts": int((span.started - origin) * 1e6),
+                "dur": int(span.duration * 1e6),
+                "args": span.attrs})
+        dump({"traceEvents": events, "displayTimeUnit": "ms"}, fileobj,
+             indent=1)
+
+    def write_openmetrics(self, fileobj):
+        """Write the duration and the bytes of each phase in the OpenMetrics
+        text format. A phase done several times is summed.
+        """
+        durations = {}
+        nbytes = {}
+        for span in self.spans:
+            durations[span.name] = durations.get(span.name, 0) + \
+                span.duration
+            if span.attrs.get("bytes") is not None:
+                nbytes[span.name] = nbytes.get(span.name, 0) + \
+                    span.attrs["bytes"]
+        lines = [
+            "# TYPE hanga_phase_duration_seconds gauge",
+            "# UNIT hanga_phase_duration_seconds seconds",
+            "# HELP hanga_phase_duration_seconds Duration of a phase of "
+            "the build."]
+        lines += ['hanga_phase_duration_seconds{{phase="{}"}} {:.6f}'.format(
+            name, value) for name, value in sorted(durations.items())]
+        lines += [
+            "# TYPE hanga_phase_bytes gauge",
+            "# UNIT hanga_phase_bytes bytes",
+            "# HELP hanga_phase_bytes Bytes processed by a phase of the "
+            "build."]
+        lines += ['hanga_phase_bytes{{phase="{}"}} {}'.format(name, value)
+                  for name, value in sorted(nbytes.items())]
+        lines.append("# EOF")
+        fileobj.write("\n".join(lines) + "\n")
@@ -1,25 +1,68 @@
+import mmap
 from os import stat
 
+UPLOAD_BLOCKSIZE = 1024 * 1024
+
 
 class TrackedFile(object):
-    def __init__(self, filename, callback):
+    """File to upload, with the progress reported to `callback`.
+
+    Requests sends it by iterating over it: the blocks of `blocksize` bytes
+    are memoryviews on a memory mapping of the file, or on a buffer reused
+    for each block when the file can't be mapped, so the content is never
+    copied. A block is only valid until the next one is requested. There is
+    intentionally no `read()`, which would make http.client send the file by
+    small blocks.
+    """
+
+    def __init__(self, filename, callback, blocksize=UPLOAD_BLOCKSIZE):
         super(TrackedFile, self).__init__()
         self._file = open(filename, 'rb')
         self._fullsize = stat(self._file.name).st_size
         self._callback = callback
+        self._blocksize = blocksize
+        self._mapping = None
 
     def __len__(self):
-        if not self._fullsize:
-            self._fullsize = stat(self._file.name).st_size
         return self._fullsize
 
     def __iter__(self):
-        return iter(self._file)
+        index = 0
+        for block in self._iter_blocks():
+            index += len(block)
+            yield block
+            if self._callback:
+                self._callback(index, self._fullsize)
+
+    def _iter_blocks(self):
+        try:
+            self._mapping = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(self._mapping)
+        except (ValueError, TypeError, EnvironmentError):
+            # empty file, or not mappable
+            return self._iter_buffer()
+        return (view[offset:offset + self._blocksize]
+                for offset in range(0, len(view), self._blocksize))
+
+    def _iter_buffer(self):
+        buf = bytearray(self._blocksize)
+        view = memoryview(buf)
+        while True:
+            size = self._file.readinto(buf)
+            if not size:
+                break
+            yield view[:size]
 
-    def read(self, blocksize=8192):
-        if self._callback:
-            self._callback(self._file.tell(), len(self))
-        return self._file.read(blocksize)
+    def tell(self):
+        return self._file.tell()
 
-    def __getattr__(self, attr):
-        return getattr(self._file, attr)
+    def close(self):
+        if self._mapping is not None:
+            try:
+                self._mapping.close()
+            except BufferError:
+                # a block is still used, unmapped when released
+                pass
+            self._mapping = None
+        self._file.close()
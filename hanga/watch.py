@@ -0,0 +1,282 @@
+"""
+Watchers of the application sources.
+
+A watcher reports the paths changed under some directories: with inotify on
+Linux (through ctypes, no dependency needed), else by comparing snapshots of
+the directories at a regular interval. Hidden directories (like `.git` or
+`.buildozer`) and the directories excluded (like the `bin` directory, where
+the builds are downloaded) are not watched::
+
+    watcher = create_watcher([source_dir], exclude=[bin_dir])
+    while True:
+        changes = wait_changes(watcher)
+        rebuild(changes)
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import select
+import struct
+import sys
+from os import close, read, stat, walk
+from os.path import join, realpath
+from time import sleep, time
+try:
+    from os import fsencode
+except ImportError:
+    fsencode = None
+
+# quiet period closing a burst of changes, in seconds
+DEBOUNCE = 0.5
+# maximum wait for the end of a burst of changes, in seconds
+MAX_DEBOUNCE = 10.
+# interval between two snapshots of the polling watcher, in seconds
+POLL_INTERVAL = 1.
+
+# inotify constants, from <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def _walk_dirs(root, exclude=()):
+    # directories to watch: the root, and all its non hidden and non
+    # excluded subdirectories
+    for dirpath, dirnames, filenames in walk(root):
+        dirnames[:] = [x for x in dirnames if not x.startswith(".") and
+                       join(dirpath, x) not in exclude]
+        yield dirpath
+
+
+class PollingWatcher(object):
+    """Watch directories by comparing the size and modification time of
+    their files every `interval` seconds, except in the directories
+    `exclude`.
+    """
+
+    name = "polling"
+
+    def __init__(self, roots, interval=POLL_INTERVAL, exclude=()):
+        super(PollingWatcher, self).__init__()
+        self.roots = roots
+        self.interval = interval
+        self.exclude = _real_paths(exclude)
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        snapshot = {}
+        for root in self.roots:
+            for dirpath in _walk_dirs(root, self.exclude):
+                try:
+                    names = next(walk(dirpath))[2]
+                except StopIteration:
+                    continue
+                for name in names:
+                    filename = join(dirpath, name)
+                    try:
+                        st = stat(filename)
+                    except OSError:
+                        continue
+                    snapshot[filename] = (st.st_size, st.st_mtime)
+        return snapshot
+
+    def read_changes(self, timeout=None):
+        """Return the set of paths changed, waiting up to `timeout` seconds
+        (forever if None) for the first change.
+        """
+        deadline = None if timeout is None else time() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = max(0, min(delay, deadline - time()))
+            sleep(delay)
+            snapshot = self._take_snapshot()
+            changes = set(
+                filename for filename in set(snapshot) | set(self._snapshot)
+                if snapshot.get(filename) != self._snapshot.get(filename))
+            self._snapshot = snapshot
+            if changes or (deadline is not None and time() >= deadline):
+                return changes
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """Watch directories with inotify, except the directories `exclude`.
+    The subdirectories created are watched too.
+
+    :raise OSError: if inotify is not available, or the limit of watches is
+                    reached.
+    """
+
+    name = "inotify"
+
+    def __init__(self, roots, exclude=()):
+        super(InotifyWatcher, self).__init__()
+        self.exclude = _real_paths(exclude)
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise _errno_error()
+        self._paths = {}
+        try:
+            for root in roots:
+                self._add_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_tree(self, root):
+        added = []
+        for dirpath in _walk_dirs(root, self.exclude):
+            path = dirpath
+            if not isinstance(path, bytes):
+                path = _fsencode(path)
+            wd = self._libc.inotify_add_watch(self._fd, path, WATCH_MASK)
+            if wd < 0:
+                error = _errno_error()
+                if error.errno == errno.ENOENT:
+                    # removed since the walk
+                    continue
+                raise error
+            self._paths[wd] = dirpath
+            added.append(dirpath)
+        return added
+
+    def read_changes(self, timeout=None):
+        """Return the set of paths changed, waiting up to `timeout` seconds
+        (forever if None) for the first change.
+        """
+        changes = set()
+        deadline = None if timeout is None else time() + timeout
+        while not changes:
+            delay = None
+            if deadline is not None:
+                delay = max(0, deadline - time())
+            try:
+                ready = select.select([self._fd], [], [], delay)[0]
+            except (OSError, select.error) as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not ready:
+                break
+            changes.update(self._read_events())
+        return changes
+
+    def _read_events(self):
+        try:
+            data = read(self._fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # events were lost: everything may have changed
+                for path in self._paths.values():
+                    yield path
+                continue
+            dirpath = self._paths.get(wd)
+            if dirpath is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._paths[wd]
+                continue
+            if not name:
+                yield dirpath
+                continue
+            name = name.decode(sys.getfilesystemencoding(), "replace")
+            if name.startswith(".") and mask & IN_ISDIR:
+                continue
+            path = join(dirpath, name)
+            if path in self.exclude:
+                continue
+            yield path
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # its files may be created before it is watched
+                for added in self._add_tree(path):
+                    yield added
+                    for filename in next(walk(added), (0, 0, []))[2]:
+                        yield join(added, filename)
+
+    def close(self):
+        if self._fd >= 0:
+            close(self._fd)
+            self._fd = -1
+
+
+def _real_paths(paths):
+    # the directories watched are compared to the real paths
+    return frozenset(realpath(x) for x in paths)
+
+
+def _fsencode(path):
+    if fsencode is not None:
+        return fsencode(path)
+    return path.encode(sys.getfilesystemencoding())
+
+
+def _errno_error():
+    code = ctypes.get_errno()
+    return OSError(code, "inotify: {}".format(
+        errno.errorcode.get(code, code)))
+
+
+def create_watcher(roots, exclude=()):
+    """Return an :class:`InotifyWatcher` of the directories `roots` if
+    possible, else a :class:`PollingWatcher`. The directories `exclude` are
+    not watched.
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots, exclude)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(roots, exclude=exclude)
+
+
+def wait_changes(watcher, timeout=None, debounce=DEBOUNCE,
+                 max_debounce=MAX_DEBOUNCE):
+    """Wait up to `timeout` seconds (forever if None) for changes, and
+    return the set of paths changed, empty if there is none.
+
+    A burst of changes, like a checkout or an editor saving many files, is
+    returned at once: after a change, the changes are collected until none
+    happen for `debounce` seconds, or for `max_debounce` seconds at most.
+    """
+    changes = watcher.read_changes(timeout)
+    if not changes:
+        return changes
+    deadline = time() + max_debounce
+    while time() < deadline:
+        more = watcher.read_changes(min(debounce, deadline - time()))
+        if not more:
+            break
+        changes |= more
+    return changes
@@ -38,6 +38,8 @@ setup(
     install_requires=[
         "requests>=2.2.1", "buildozer>=0.13",
         "progressbar2>=2.6.0", "docopt>=0.6.1"],
+    extras_require={
+        "async": ["aiohttp>=3.3"]},
     packages=["hanga", "hanga.scripts"],
     include_package_data=True,
     zip_safe=False,
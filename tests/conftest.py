@@ -0,0 +1,19 @@
+import pytest
+from hanga.api import HangaAPI
+from hanga.fakeserver import FakeHangaServer
+
+KEY = "0" * 32
+
+
+@pytest.fixture
+def server():
+    server = FakeHangaServer(key=KEY, build_time=0.5)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def api(server):
+    with HangaAPI(key=KEY, url=server.url) as api:
+        yield api
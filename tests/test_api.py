@@ -0,0 +1,122 @@
+import os
+import pytest
+from hanga.api import HangaException
+
+PART_SIZE = 16384
+
+
+@pytest.fixture
+def archive(tmpdir):
+    filename = tmpdir.join("app.zip")
+    filename.write_binary(os.urandom(PART_SIZE * 5 + 100))
+    return str(filename)
+
+
+def test_chunked_upload(server, api, archive):
+    result = api.submit_chunked(["android"], archive, part_size=PART_SIZE,
+                                workers=3)
+    assert result["result"] == "ok"
+    with open(archive, "rb") as fd:
+        assert server.hanga.jobs[result["uuid"]]["archive"] == fd.read()
+
+
+def test_chunked_upload_resumed(server, api, archive, monkeypatch):
+    server.hanga.failure_rate = 1.
+    with pytest.raises(HangaException) as info:
+        api.submit_chunked(["android"], archive, part_size=PART_SIZE,
+                           retries=1)
+    upload_id = info.value.upload_id
+    assert upload_id
+
+    # part of the upload made before the interruption
+    server.hanga.failure_rate = 0.
+    with open(archive, "rb") as fd:
+        api.upload_part(upload_id, 0, fd.read(PART_SIZE))
+    sent = []
+    upload_part = api.upload_part
+
+    def spy(upload_id, index, data):
+        sent.append(index)
+        return upload_part(upload_id, index, data)
+
+    monkeypatch.setattr(api, "upload_part", spy)
+    result = api.submit_chunked(["android"], archive, part_size=PART_SIZE,
+                                upload_id=upload_id)
+    assert result["result"] == "ok"
+    assert sorted(sent) == [1, 2, 3, 4, 5]
+    with open(archive, "rb") as fd:
+        assert server.hanga.jobs[result["uuid"]]["archive"] == fd.read()
+
+
+def test_chunked_upload_resumed_with_another_file(server, api, archive,
+                                                  tmpdir):
+    server.hanga.failure_rate = 1.
+    with pytest.raises(HangaException) as info:
+        api.submit_chunked(["android"], archive, part_size=PART_SIZE,
+                           retries=0)
+    other = tmpdir.join("other.zip")
+    other.write_binary(os.urandom(os.path.getsize(archive)))
+    server.hanga.failure_rate = 0.
+    with pytest.raises(HangaException) as mismatch:
+        api.submit_chunked(["android"], str(other), part_size=PART_SIZE,
+                           upload_id=info.value.upload_id)
+    assert "is not the file of the upload" in str(mismatch.value)
+
+
+def submit(api, archive):
+    result = api.submit(["android"], archive)
+    assert result["result"] == "ok"
+    return result["uuid"]
+
+
+def test_status_stream(server, api, archive):
+    uuid = submit(api, archive)
+    statuses = list(api.iter_status(uuid))
+    assert statuses[-1]["job_status"] == "done"
+    assert api._stream_status is True
+
+
+@pytest.mark.parametrize("code", [500, 503])
+def test_status_stream_failing(server, api, archive, monkeypatch, code):
+    # the stream is retried, then the status polled
+    from hanga import api as api_module
+    from hanga.fakeserver import FakeHangaHandler
+    attempts = []
+
+    def do_status_stream(handler):
+        attempts.append(1)
+        handler.send_json({"result": "error"}, code)
+
+    monkeypatch.setattr(FakeHangaHandler, "do_status_stream",
+                        do_status_stream)
+    monkeypatch.setattr(api_module, "sleep", lambda delay: None)
+    uuid = submit(api, archive)
+    statuses = list(api.iter_status(uuid, wait=1))
+    assert statuses[-1]["job_status"] == "done"
+    assert len(attempts) == api_module.STREAM_RECONNECTS + 1
+    # the stream may work for the next builds
+    assert api._stream_status is not False
+
+
+def test_status_stream_unsupported(server, api, archive, monkeypatch):
+    from hanga.fakeserver import FakeHangaHandler
+    monkeypatch.setattr(FakeHangaHandler, "do_status_stream",
+                        lambda handler: handler.send_json({}, 404))
+    uuid = submit(api, archive)
+    statuses = list(api.iter_status(uuid, wait=1))
+    assert statuses[-1]["job_status"] == "done"
+    assert api._stream_status is False
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_download_replaces_previous(server, api, archive, tmpdir, workers):
+    uuid = submit(api, archive)
+    list(api.iter_status(uuid))
+    expected_fn, content = server.hanga.artifact(uuid)
+    dest_dir = tmpdir.mkdir("bin")
+    dest_dir.join(expected_fn).write_binary(b"previous build")
+    filename = api.download(uuid, str(dest_dir), workers=workers,
+                            segment_size=PART_SIZE * 4)
+    assert filename == expected_fn
+    assert dest_dir.join(filename).read_binary() == content
+    assert dest_dir.listdir() == [dest_dir.join(filename)]
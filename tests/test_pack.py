@@ -0,0 +1,141 @@
+import io
+import os
+import zipfile
+import zlib
+import pytest
+from hashlib import sha256
+from hanga import pack
+from hanga.pack import (
+    CompressionPolicy, METHODS, ZIP64_LIMIT, ZIP_STORED, ZipWriter,
+    iter_pack, lzma)
+
+TEXT = b"".join(b"line %d of a text file\n" % i for i in range(20000))
+
+
+@pytest.fixture
+def sources(tmpdir):
+    tmpdir.join("main.py").write_binary(b"print('hello')\n" * 50)
+    tmpdir.join("text.txt").write_binary(TEXT)
+    tmpdir.join("random.bin").write_binary(os.urandom(50000))
+    tmpdir.join("image.png").write_binary(os.urandom(20000))
+    tmpdir.join("tiny.py").write_binary(b"x = 1\n")
+    tmpdir.join("empty.txt").write_binary(b"")
+    tmpdir.join(u"caf\xe9.kv").write_binary(b"<Label>:\n" * 30)
+    return [(str(tmpdir.join(name)), name) for name in sorted(
+        os.listdir(str(tmpdir)))] + [(b"generated" * 100, "generated.txt")]
+
+
+def check_archive(data, members):
+    with zipfile.ZipFile(io.BytesIO(data)) as zfile:
+        assert zfile.testzip() is None
+        assert zfile.namelist() == [name for _, name in members]
+        for source, name in members:
+            if not isinstance(source, bytes):
+                with open(source, "rb") as fd:
+                    source = fd.read()
+            assert zfile.read(name) == source
+        return zfile.infolist()
+
+
+@pytest.mark.parametrize("method", sorted(METHODS))
+@pytest.mark.parametrize("workers", [1, 4])
+def test_round_trip(sources, method, workers):
+    if method == "lzma" and lzma is None:
+        pytest.skip("lzma is not available")
+    policy = CompressionPolicy(text_method=METHODS[method])
+    fileobj = io.BytesIO()
+    digest = pack.pack(sources, fileobj, workers=workers, policy=policy)
+    infos = check_archive(fileobj.getvalue(), sources)
+    methods = dict((info.filename, info.compress_type) for info in infos)
+    assert methods["text.txt"] == METHODS[method]
+    assert methods["image.png"] == ZIP_STORED
+    assert methods["random.bin"] == ZIP_STORED
+    assert methods["tiny.py"] == ZIP_STORED
+    assert digest == sha256(fileobj.getvalue()).hexdigest()
+
+
+@pytest.mark.parametrize("method", sorted(METHODS))
+def test_round_trip_streamed(sources, method, monkeypatch):
+    # every file is compressed while written, with a data descriptor
+    if method == "lzma" and lzma is None:
+        pytest.skip("lzma is not available")
+    monkeypatch.setattr(pack, "STREAM_SIZE", 1)
+    monkeypatch.setattr(pack, "BLOCKSIZE", 4096)
+    policy = CompressionPolicy(text_method=METHODS[method])
+    chunks = list(iter_pack(sources, workers=2, policy=policy))
+    # not a chunk per member, the compressors only buffer some blocks
+    assert max(len(chunk) for chunk in chunks) < len(TEXT) // 8
+    check_archive(b"".join(chunks), sources)
+
+
+def test_same_archive_whatever_the_workers(sources):
+    archives = []
+    for workers in (1, 2, 8):
+        fileobj = io.BytesIO()
+        pack.pack(sources, fileobj, workers=workers, reproducible=True)
+        archives.append(fileobj.getvalue())
+    assert archives[0] == archives[1] == archives[2]
+    assert b"".join(iter_pack(sources, reproducible=True)) == archives[0]
+
+
+def test_many_entries():
+    # over 65535 entries, the zip64 end of central directory is needed
+    members = [(b"%d" % i, "f%d" % i) for i in range(70000)]
+    data = b"".join(iter_pack(members, workers=1))
+    with zipfile.ZipFile(io.BytesIO(data)) as zfile:
+        assert zfile.testzip() is None
+        assert len(zfile.infolist()) == 70000
+        assert zfile.read("f69999") == b"69999"
+
+
+class SparseFile(object):
+    # file skipping the blocks of zeros instead of writing them
+    def __init__(self, fd):
+        self.fd = fd
+
+    def write(self, data):
+        if len(data) > 4096 and data.count(b"\0") == len(data):
+            self.fd.seek(len(data), 1)
+        else:
+            self.fd.write(data)
+
+
+def test_zip64(tmpdir):
+    block = bytes(bytearray(pack.BLOCKSIZE))
+    count = ZIP64_LIMIT // len(block) + 2
+    zip_fn = str(tmpdir.join("big.zip"))
+    with open(zip_fn, "wb") as fd:
+        writer = ZipWriter(SparseFile(fd))
+        for _ in writer.add_stream("big.bin", (block for _ in range(count)),
+                                   size_hint=count * len(block)):
+            pass
+        # after the big member, the offset needs zip64 too
+        writer.add("small.txt", b"small",
+                   zlib.crc32(b"small") & 0xffffffff, 5)
+        writer.close()
+        fd.truncate(fd.tell())
+
+    with zipfile.ZipFile(zip_fn) as zfile:
+        big, small = zfile.infolist()
+        assert big.file_size == big.compress_size == count * len(block)
+        assert small.header_offset > ZIP64_LIMIT
+        assert zfile.testzip() is None
+
+
+@pytest.mark.parametrize("name", ["big.json", "big.png"])
+def test_streamed_member_cached(tmpdir, name):
+    from hanga.cache import PackCache
+    source = tmpdir.join(name)
+    source.write_binary((TEXT * (pack.STREAM_SIZE // len(TEXT) + 1))[
+        :pack.STREAM_SIZE + 1000])
+    members = [(str(source), name)]
+    archives = []
+    for _ in range(2):
+        cache = PackCache(root=str(tmpdir.join("cache")))
+        fileobj = io.BytesIO()
+        pack.pack(members, fileobj, workers=2, cache=cache,
+                  reproducible=True)
+        archives.append(fileobj.getvalue())
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert archives[0] == archives[1]
+    check_archive(archives[1], members)
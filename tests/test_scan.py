@@ -0,0 +1,63 @@
+import os
+import pytest
+from buildozer import Buildozer
+from hanga.scan import SourceScanner
+
+FILES = (
+    "main.py", "LICENSE", "README", "Upper/MAIN.PY", "lib/util.py",
+    "lib/data.json", "lib/tests/test_util.py", "tests/test_main.py",
+    "bin/tool.py", ".git/config", ".hidden.py", "lib/.cache/x.py",
+    "images/a.png", "images/sub/b.jpg", "images/keep/c.jpg",
+    "images/keep/deep/d.jpg", "docs/index.md", "docs/api/ref.md")
+
+RULES = [
+    "",
+    "source.include_exts = py,png,jpg,kv",
+    "source.exclude_exts = spec,md",
+    "source.exclude_dirs = tests, bin, docs/api",
+    "source.exclude_dirs = tests\nsource.include_exts = py",
+    "source.exclude_patterns = license,images/*/*.jpg",
+    "source.exclude_patterns = images/*\n"
+    "source.include_patterns = images/keep/*",
+    "source.exclude_dirs = lib\nsource.include_patterns = lib/tests/*",
+    "source.exclude_patterns = */tests/*,docs/*\n"
+    "source.exclude_dirs = images/sub",
+]
+
+
+class CopyBuildozer(Buildozer):
+    # copy the application sources to a given directory
+    @property
+    def app_dir(self):
+        return self._app_dir
+
+
+def buildozer_selection(source_dir, app_dir):
+    buildozer = CopyBuildozer(filename=os.path.join(
+        source_dir, "buildozer.spec"))
+    buildozer._app_dir = app_dir
+    buildozer._copy_application_sources()
+    selected = set()
+    for root, dirs, files in os.walk(app_dir):
+        rel_dir = os.path.relpath(root, app_dir).replace(os.sep, "/")
+        for fn in files:
+            selected.add(fn if rel_dir == "." else rel_dir + "/" + fn)
+    return buildozer, selected
+
+
+@pytest.mark.parametrize("rules", RULES)
+def test_same_selection_as_buildozer(tmpdir, monkeypatch, rules):
+    source_dir = tmpdir.mkdir("app")
+    for name in FILES:
+        source_dir.join(name).write("content", ensure=True)
+    source_dir.join("buildozer.spec").write(
+        "[app]\ntitle = Test\npackage.name = test\n"
+        "package.domain = org.test\nversion = 1.0\nsource.dir = .\n" +
+        rules + "\n")
+    monkeypatch.chdir(str(source_dir))
+
+    buildozer, expected = buildozer_selection(
+        str(source_dir), str(tmpdir.join("copy")))
+    scanner = SourceScanner.from_config(buildozer.config, str(source_dir))
+    selected = set(rel_fn for _, rel_fn, _ in scanner.scan())
+    assert selected == expected
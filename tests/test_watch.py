@@ -0,0 +1,64 @@
+import pytest
+from os.path import join
+from hanga.scan import SourceScanner
+from hanga.scripts.builder import HangaClient
+from hanga.watch import InotifyWatcher, PollingWatcher, wait_changes
+
+
+@pytest.fixture
+def client(tmpdir):
+    tmpdir.join("main.py").write("print('hello')\n")
+    tmpdir.join("buildozer.spec").write(
+        "[app]\ntitle = Test\npackage.name = test\n"
+        "package.domain = org.test\nversion = 1.0\nsource.dir = .\n")
+    client = HangaClient(filename=str(tmpdir.join("buildozer.spec")))
+    client.arguments = {}
+    client.config.set("app", "source.dir", str(tmpdir))
+    tmpdir.mkdir("bin")
+    tmpdir.mkdir(".buildozer")
+    return client
+
+
+def scan(client, source_dir):
+    scanner = SourceScanner.from_config(client.config, str(source_dir))
+    client._sources = list(scanner.scan())
+
+
+def download(client):
+    # what a download writes in the bin directory
+    bin_dir = client.bin_dir
+    with open(join(bin_dir, "test-1.0.apk.part"), "w") as fd:
+        fd.write("apk")
+    with open(join(bin_dir, "test-1.0.apk.part.json"), "w") as fd:
+        fd.write("{}")
+
+
+@pytest.mark.parametrize("cls", [InotifyWatcher, PollingWatcher])
+def test_download_not_watched(tmpdir, client, cls):
+    try:
+        watcher = cls([str(tmpdir)], exclude=client.cloud_watch_excluded())
+    except OSError:
+        pytest.skip("inotify is not available")
+    if cls is PollingWatcher:
+        watcher.interval = 0.1
+    try:
+        download(client)
+        assert not wait_changes(watcher, 0.5, 0.1)
+        tmpdir.join("main.py").write("print('changed')\n")
+        assert str(tmpdir.join("main.py")) in wait_changes(watcher, 2, 0.1)
+    finally:
+        watcher.close()
+
+
+def test_download_not_submitted(tmpdir, client):
+    # the sources of the bin directory are packed like Buildozer does, but
+    # a download doesn't start a new build
+    scan(client, tmpdir)
+    snapshot = client.cloud_sources_snapshot()
+    download(client)
+    scan(client, tmpdir)
+    assert "bin/test-1.0.apk.part" in [x[1] for x in client._sources]
+    assert client.cloud_sources_snapshot() == snapshot
+    tmpdir.join("main.py").write("print('changed, longer')\n")
+    scan(client, tmpdir)
+    assert client.cloud_sources_snapshot() != snapshot